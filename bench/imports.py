@@ -0,0 +1,55 @@
+# Checks how long importing each central module takes against a budget, in fresh interpreters,
+# and that none of them import the heavy dependencies only needed once used
+#
+# Usage: python bench/imports.py [budget in ms]
+
+import os
+import sys
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from central import uux
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ["central", "central.env", "central.metrics", "central.urls", "central.uux",
+	"central.files", "central.net", "central.parse", "central.crawl"]
+"""Modules checked, dc is left out as discord clients need discord imported."""
+
+DEFERRED = ["asyncio", "requests", "urllib3", "bs4", "lxml", "html5_parser"]
+"""Modules importing central must not import."""
+
+IMPORT_BUDGET = 0.1
+"""Seconds importing a module may take, including what it imports."""
+
+IMPORT_REPEATS = 5
+"""Times each module is imported, the best time counts."""
+
+def time_import(module: str) -> tuple:
+	"""Import the module in a fresh interpreter, returning the seconds it took and the deferred modules it imported."""
+	code = ("import sys, time; sys.path.insert(0, " + repr(ROOT) + "); start = time.perf_counter(); import " + module
+		+ "; print(time.perf_counter() - start); print(','.join(m for m in " + repr(DEFERRED) + " if m in sys.modules))")
+	output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.split("\n")
+	return float(output[0]), [name for name in output[1].split(",") if name]
+
+def main(budget: float) -> bool:
+	passed = True
+	for module in MODULES:
+		results = [time_import(module) for _ in range(IMPORT_REPEATS)]
+		elapsed = min(result[0] for result in results)
+		imported = results[0][1]
+
+		line = module + " " + f'{elapsed * 1000:.1f}' + "ms"
+		if imported:
+			uux.show_error(line + ", imported " + ", ".join(imported))
+			passed = False
+		elif elapsed > budget:
+			uux.show_error(line + ", over the " + f'{budget * 1000:.0f}' + "ms budget")
+			passed = False
+		else:
+			uux.show_success(line)
+	return passed
+
+if __name__ == "__main__":
+	sys.exit(0 if main(float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else IMPORT_BUDGET) else 1)
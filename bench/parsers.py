@@ -0,0 +1,65 @@
+# Compares the speed of the html parsers soups can be built with, on the saved fixture pages
+#
+# Usage: python bench/parsers.py [repeats]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from central import uux
+from central import net
+from central import parse
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+def load_fixtures() -> dict:
+	"""Load every fixture page as name => markup."""
+	fixtures = {}
+	for name in sorted(os.listdir(FIXTURES)):
+		if name.endswith(".html"):
+			with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+				fixtures[name[:-5]] = f.read()
+	return fixtures
+
+def time_parser(markup: str, parser: str, repeats: int) -> tuple:
+	"""Return the best time to build a soup and extract its content, and the extracted content."""
+	best = None
+	content = None
+	for _ in range(repeats):
+		start = time.perf_counter()
+		content = parse.story_content(net.make_soup(markup, parser))
+		elapsed = time.perf_counter() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return best, content
+
+def main(repeats: int) -> None:
+	uux.UUXDEBUG = False
+	# The slowest, html.parser, is the reference the others are compared to
+	parsers = net.available_parsers()[::-1]
+	uux.show_info("Parsers: %s", ", ".join(parsers))
+
+	totals = dict.fromkeys(parsers, 0.0)
+	for name, markup in load_fixtures().items():
+		reference = None
+		results = []
+
+		for parser in parsers:
+			elapsed, content = time_parser(markup, parser, repeats)
+			totals[parser] += elapsed
+
+			if reference is None:
+				reference = (elapsed, content)
+			speedup = reference[0] / elapsed
+			same = ("", " (content differs)")[content != reference[1]]
+			results.append(parser + " " + f'{elapsed * 1000:.2f}' + "ms x" + f'{speedup:.2f}' + same)
+
+		uux.show_list(name + " [" + str(len(markup)) + " Bytes]", results)
+
+	reference = totals[parsers[0]]
+	uux.show_list("Total", [parser + " " + f'{total * 1000:.2f}' + "ms x" + f'{reference / total:.2f}' for parser, total in totals.items()])
+
+if __name__ == "__main__":
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
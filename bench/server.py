@@ -0,0 +1,91 @@
+# Local stand-in http server for the benchmarks, serving the files of a folder
+# with keep-alive connections, ETags and single byte ranges like a real web server
+
+import os
+import re
+import sys
+import hashlib
+import threading
+import http.server
+
+_RE_RANGE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+class Handler(http.server.BaseHTTPRequestHandler):
+	"""Serves files from the folder of the server, `server.root`."""
+
+	protocol_version = "HTTP/1.1"
+
+	# Headers and body are written separately, which Nagle would hold back for a delayed ack
+	disable_nagle_algorithm = True
+
+	def do_GET(self) -> None:
+		path = os.path.join(self.server.root, self.path.split("?")[0].lstrip("/"))
+		if not os.path.isfile(path):
+			self.send_error(404)
+			return
+
+		with open(path, "rb") as f:
+			data = f.read()
+		etag = '"' + hashlib.md5(data).hexdigest() + '"'
+
+		if self.headers.get("If-None-Match") == etag:
+			self.send_response(304)
+			self.send_header("ETag", etag)
+			self.send_header("Content-Length", "0")
+			self.end_headers()
+			return
+
+		status = 200
+		start, end = 0, len(data)
+
+		match = _RE_RANGE.match(self.headers.get("Range", ""))
+		if match is not None:
+			first, last = match.groups()
+			if first:
+				start = int(first)
+				if last:
+					end = min(int(last) + 1, len(data))
+			elif last:
+				start = max(0, len(data) - int(last))
+
+			if start >= len(data):
+				self.send_response(416)
+				self.send_header("Content-Range", "bytes */" + str(len(data)))
+				self.send_header("Content-Length", "0")
+				self.end_headers()
+				return
+			status = 206
+
+		self.send_response(status)
+		self.send_header("ETag", etag)
+		self.send_header("Accept-Ranges", "bytes")
+		self.send_header("Content-Length", str(end - start))
+		if status == 206:
+			self.send_header("Content-Range", "bytes " + str(start) + "-" + str(end - 1) + "/" + str(len(data)))
+		self.end_headers()
+		self.wfile.write(data[start:end])
+
+	def log_message(self, format, *args) -> None:
+		# Logging each request would be most of what is measured
+		pass
+
+class Server(http.server.ThreadingHTTPServer):
+	"""Threaded server that expects clients to hang up early."""
+
+	daemon_threads = True
+
+	def handle_error(self, request, client_address) -> None:
+		# Download probes read one byte of a range and close, which is not an error
+		if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+			return
+		super().handle_error(request, client_address)
+
+def start(root: str, handler=Handler) -> tuple:
+	"""Serve the folder on a free local port from a background thread. Returns the server, and its base url.
+
+	`handler` can be a subclass of `Handler` serving some requests differently."""
+	server = Server(("127.0.0.1", 0), handler)
+	server.root = root
+
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server, "http://127.0.0.1:" + str(server.server_address[1]) + "/"
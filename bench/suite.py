@@ -0,0 +1,249 @@
+# Times the cache, parse and net hot paths on local fixtures, and compares them to a stored baseline
+#
+# Every case runs against the fixture pages, synthetic cache corpora and files, and a
+# local stand-in server, so results only depend on the machine they are run on.
+# Throughput is reported per second alongside latency percentiles of single runs.
+#
+# Usage: python bench/suite.py [--save] [case prefix...]
+#   --save  Store the results as the new baseline
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from central import uux
+from central import net
+from central import parse
+from central import files
+from central import urls
+
+import parsers
+import server
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+
+BASELINE = os.path.join(BENCH, "baseline.json")
+"""Results the current run is compared to, written by `--save`."""
+
+BENCH_TIME = 1.0
+"""Seconds each case is repeated for."""
+
+BENCH_MIN_RUNS = 5
+"""Fewest times each case is run, however long it takes."""
+
+BENCH_TOLERANCE = 0.2
+"""Fraction of baseline throughput a case can lose before it is marked as slower."""
+
+root = None
+"""Temporary folder the cases work in, and the server serves."""
+
+base_url = None
+"""Url of the local server."""
+
+CASES = {}
+"""Case name => function preparing it, returning `(run, items, unit)`: the function
+timed, and how many items of the unit it handles per run."""
+
+def case(name: str):
+	"""Register the decorated function as the benchmark case of the name."""
+	def register(prepare):
+		CASES[name] = prepare
+		return prepare
+	return register
+
+def measure(run, items: int) -> dict:
+	"""Repeat a run for `BENCH_TIME` seconds, returning its throughput in items per second and latency percentiles in seconds."""
+	times = []
+	while len(times) < BENCH_MIN_RUNS or sum(times) < BENCH_TIME:
+		start = time.perf_counter()
+		run()
+		times.append(time.perf_counter() - start)
+
+	times.sort()
+	return {
+		"runs": len(times),
+		"throughput": items * len(times) / sum(times),
+		"p50": percentile(times, 50),
+		"p90": percentile(times, 90),
+		"p99": percentile(times, 99),
+	}
+
+def percentile(times: list, percent: int) -> float:
+	"""Return the nearest-rank percentile of sorted times."""
+	return times[max(0, -(-len(times) * percent // 100) - 1)]
+
+def corpus(count: int, size: int) -> list:
+	"""Create a synthetic cache corpus of objects, shaped like the page records the cache mostly holds."""
+	rng = random.Random(size)
+	words = ["story", "chapter", "the", "said", "and", "thread", "mark", "page", "she", "ran"]
+	objects = []
+	for i in range(count):
+		text = " ".join(rng.choice(words) for _ in range(size // 6))
+		objects.append({"url": "https://www.site.com/threads/" + str(i), "title": str(i), "next": None, "content": [text]})
+	return objects
+
+@case("cache_save")
+def prepare_cache_save():
+	objects = corpus(100, 2048)
+	def run():
+		for i, obj in enumerate(objects):
+			files.cache_save("bench-" + str(i), obj)
+	return run, len(objects), "objects"
+
+@case("cache_get_disk")
+def prepare_cache_get_disk():
+	objects = corpus(100, 2048)
+	for i, obj in enumerate(objects):
+		files.cache_save("bench-disk-" + str(i), obj)
+
+	def run():
+		files.cache_memory_clear()
+		for i in range(len(objects)):
+			files.cache_get("bench-disk-" + str(i))
+	return run, len(objects), "objects"
+
+@case("cache_get_memory")
+def prepare_cache_get_memory():
+	objects = corpus(100, 2048)
+	for i, obj in enumerate(objects):
+		files.cache_save("bench-memory-" + str(i), obj)
+
+	def run():
+		for i in range(len(objects)):
+			files.cache_get("bench-memory-" + str(i))
+	return run, len(objects), "objects"
+
+def prepare_story_content(markup: str):
+	def run():
+		parse.story_content(net.make_soup(markup))
+	return run, len(markup) / 1e6, "MB"
+
+for fixture, markup in parsers.load_fixtures().items():
+	case("story_content/" + fixture)(lambda markup=markup: prepare_story_content(markup))
+
+@case("cleanup_text")
+def prepare_cleanup_text():
+	texts = [net.make_soup(markup).text for markup in parsers.load_fixtures().values()]
+	size = sum(len(text) for text in texts)
+	def run():
+		for text in texts:
+			parse.cleanup_text(text)
+	return run, size / 1e6, "MB"
+
+def bench_urls() -> list:
+	"""Return story urls in the shapes users enter them."""
+	rng = random.Random(0)
+	shapes = ["https://www.site.com/threads/story.{0}/page-{1}#post-{2}", "site.com/threads/story.{0}/page-{1}",
+		"http://forum.site.com//threads/story.{0}/page-{1}?view={2}"]
+	return [rng.choice(shapes).format(i, rng.randint(1, 50), rng.randint(1, 99999)) for i in range(1000)]
+
+@case("normalize_url")
+def prepare_normalize_url():
+	addresses = bench_urls()
+	def run():
+		# Every url is new to the memoized functions
+		urls.cache_clear()
+		for address in addresses:
+			net.normalize_url(address)
+	return run, len(addresses), "urls"
+
+@case("normalize_url_cached")
+def prepare_normalize_url_cached():
+	addresses = bench_urls()
+	def run():
+		for address in addresses:
+			net.normalize_url(address)
+	return run, len(addresses), "urls"
+
+@case("hashFile")
+def prepare_hash_file():
+	path = os.path.join(root, "hash.bin")
+	with open(path, "wb") as f:
+		f.write(os.urandom(16 * 1024 * 1024))
+	def run():
+		files.hashFile(path)
+	return run, 16 * 1024 * 1024 / 1e6, "MB"
+
+@case("get_request")
+def prepare_get_request():
+	address = base_url + "fixtures/xenforo2_threadmarks.html"
+	def run():
+		net.get_request(address)
+	return run, 1, "requests"
+
+@case("download_file")
+def prepare_download_file():
+	with open(os.path.join(root, "download.bin"), "wb") as f:
+		f.write(os.urandom(8 * 1024 * 1024))
+	location = os.path.join(root, "downloaded.bin")
+	def run():
+		files.download_file(base_url + "download.bin", location)
+		os.remove(location)
+	return run, 8 * 1024 * 1024 / 1e6, "MB"
+
+def compare(name: str, result: dict, baseline: dict) -> str:
+	"""Return the line showing a result and how it compares to the baseline."""
+	unit = result["unit"] + "/s"
+	line = (name + " " + f'{result["throughput"]:.2f}' + " " + unit
+		+ " | p50 " + f'{result["p50"] * 1000:.3f}' + "ms"
+		+ " p90 " + f'{result["p90"] * 1000:.3f}' + "ms"
+		+ " p99 " + f'{result["p99"] * 1000:.3f}' + "ms")
+
+	if name in baseline:
+		ratio = result["throughput"] / baseline[name]["throughput"]
+		line += " | x" + f'{ratio:.2f}' + " baseline"
+		if ratio < 1 - BENCH_TOLERANCE:
+			line += " (slower)"
+	return line
+
+def show_result(line: str) -> None:
+	"""Show a result line, while info messages of the code measured stay hidden."""
+	uux.UUXINFO = True
+	uux.show_info(line)
+	uux.UUXINFO = False
+
+def main(save: bool, prefixes: list) -> None:
+	global root, base_url
+
+	uux.UUXDEBUG = False
+	uux.UUXINFO = False
+
+	baseline = {}
+	if os.path.exists(BASELINE):
+		with open(BASELINE) as f:
+			baseline = json.load(f)
+
+	root = tempfile.mkdtemp(prefix="central-bench-")
+	shutil.copytree(parsers.FIXTURES, os.path.join(root, "fixtures"))
+	files.CACHE_DIR = os.path.join(root, "Cached") + "/"
+	files.cache_create()
+	httpd, base_url = server.start(root)
+
+	results = {}
+	try:
+		for name, prepare in CASES.items():
+			if prefixes and not any(name.startswith(prefix) for prefix in prefixes):
+				continue
+
+			run, items, unit = prepare()
+			results[name] = dict(measure(run, items), unit=unit)
+			show_result(compare(name, results[name], baseline))
+	finally:
+		httpd.shutdown()
+		shutil.rmtree(root, ignore_errors=True)
+
+	if save:
+		baseline.update(results)
+		with open(BASELINE, "w") as f:
+			json.dump(baseline, f, indent="\t")
+		uux.show_success("Saved baseline of " + str(len(results)) + " cases to " + BASELINE)
+
+if __name__ == "__main__":
+	arguments = sys.argv[1:]
+	main("--save" in arguments, [argument for argument in arguments if argument != "--save"])
@@ -1 +1,17 @@
-"""Central: A centralized library of common python tasks."""
+"""Central: A centralized library of common python tasks.
+
+Submodules are imported on first use, so `import central` costs next to nothing:
+`central.net` works without importing `central.net` beforehand.
+"""
+
+import importlib
+
+__all__ = ["crawl", "data", "dc", "env", "files", "metrics", "net", "parse", "urls", "uux"]
+
+def __getattr__(name: str):
+	if name in __all__:
+		return importlib.import_module("." + name, __name__)
+	raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
+
+def __dir__() -> list:
+	return sorted(list(globals()) + __all__)
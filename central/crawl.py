@@ -0,0 +1,134 @@
+"""central.crawl: Story Crawling.
+
+Asynchronous walking of multi-page stories, by following each page's next link.
+Aim is to keep the network busy while pages are being read, fetching, parsing and
+extracting the following pages in the background.
+"""
+
+from __future__ import annotations
+
+import typing
+import urllib.parse
+import weakref
+from . import uux
+from . import net
+from . import parse
+from . import files
+
+# asyncio is imported by the functions using it, most of what importing crawl would take
+if typing.TYPE_CHECKING:
+	import asyncio
+
+CRAWL_PREFETCH = 3
+"""Number of pages fetched and extracted ahead of the page being read."""
+
+CRAWL_HOST_LIMIT = 4
+"""Maximum number of pages fetched from a single host at once, across all crawls."""
+
+_host_limits = weakref.WeakKeyDictionary()
+"""Event loop => host => `asyncio.Semaphore`."""
+
+async def crawl_story(url: str, prefetch=None, host_limit=None):
+	"""Asynchronously iterate the pages of a story as `(url, content)`, starting at the provided url.
+
+	While a page is being read, up to `prefetch` (defaults to `CRAWL_PREFETCH`) following
+	pages are fetched, parsed and extracted in the background.
+
+	Usage: `async for url, content in crawl_story(url): ...`"""
+	import asyncio
+
+	if prefetch is None:
+		prefetch = CRAWL_PREFETCH
+	if host_limit is None:
+		host_limit = CRAWL_HOST_LIMIT
+
+	pages = asyncio.Queue()
+	ahead = asyncio.Semaphore(prefetch + 1)
+	walker = asyncio.ensure_future(_walk_story(url, pages, ahead, host_limit))
+
+	try:
+		while True:
+			page = await pages.get()
+			if page is None:
+				break
+
+			page_url, content = page
+			yield page_url, await content
+			ahead.release()
+
+		# Raise anything that stopped the walk early
+		await walker
+	finally:
+		walker.cancel()
+
+async def _walk_story(url: str, pages: asyncio.Queue, ahead: asyncio.Semaphore, host_limit: int) -> None:
+	"""Follow the next links from the provided url, queueing `(url, content future)` for each page."""
+	import asyncio
+
+	loop = asyncio.get_running_loop()
+	seen = set()
+
+	try:
+		# Pages are kept by their normalized url, links are relative to the url as linked
+		link = url
+		url = net.normalize_url(link)
+
+		while url is not None and url not in seen:
+			seen.add(url)
+			await ahead.acquire()
+
+			async with _host_semaphore(url, host_limit):
+				page = await loop.run_in_executor(None, net.get_page_cached, url)
+
+			if page is None:
+				uux.show_warning("Stopped crawling at '" + url + "', page unavailable")
+				break
+
+			# Records are only used while the page they were built from is current
+			record = await loop.run_in_executor(None, parse.cached_page_record, url, page)
+			if record is not None:
+				pages.put_nowait((url, _completed(record["content"])))
+				link = record["next"]
+				url = net.normalize_url(link) if link is not None else None
+				continue
+
+			# The next link is all that holds up the next fetch, extraction runs alongside it
+			soup, next_url = await loop.run_in_executor(None, _page_links, page, link)
+
+			content = loop.run_in_executor(None, _page_content, url, soup, next_url, page)
+			pages.put_nowait((url, content))
+
+			link = next_url
+			url = net.normalize_url(link) if link is not None else None
+	finally:
+		pages.put_nowait(None)
+
+def _page_links(page: str, link: str) -> tuple:
+	"""Parse a page linked as the provided url, returning its soup and the next link found in it."""
+	soup = parse.story_soup(page)
+	return soup, parse.next_story_link(soup, link)
+
+def _page_content(url: str, soup, next_url: str, page: str) -> list:
+	"""Extract the content of a page from its soup, caching the page record `parse.analyse_page()` would create."""
+	record = parse.page_record(url, soup, next_url, parse.page_source(page))
+	files.cache_save_hashed(url + "page", record)
+	return record["content"]
+
+def _completed(result) -> asyncio.Future:
+	"""Return a future already holding the provided result."""
+	import asyncio
+
+	future = asyncio.get_running_loop().create_future()
+	future.set_result(result)
+	return future
+
+def _host_semaphore(url: str, limit: int) -> asyncio.Semaphore:
+	"""Return the semaphore limiting concurrent fetches from the host of the provided url."""
+	import asyncio
+
+	hosts = _host_limits.setdefault(asyncio.get_running_loop(), {})
+	host = urllib.parse.urlsplit(url).netloc
+
+	if host not in hosts:
+		hosts[host] = asyncio.Semaphore(limit)
+	return hosts[host]
@@ -5,17 +5,47 @@ Aim is to provide simple and common functions to deal with discord bots
 Also check out behaviours for message responses and scenarios
 """
 
+from __future__ import annotations
+
+import time
+import asyncio
 from . import uux
 import discord.client
 
+DC_MESSAGE_LIMIT = 2000
+"""Most characters discord allows in a single message."""
+
+DC_SEND_RATE = 1.0
+"""Messages per second sent to a single channel, once its burst is used up."""
+
+DC_SEND_BURST = 5
+"""Messages sent to a single channel at once before `DC_SEND_RATE` applies."""
+
+DC_QUEUE_SIZE = 100
+"""Messages waiting per channel before `SendQueue.send()` waits for room."""
+
+DC_RETRIES = 3
+"""Times a message is sent again after being rate limited."""
+
+DC_RETRY_AFTER = 1.0
+"""Seconds waited before sending again after being rate limited, when discord does not say."""
+
+_send_queues = {}
+"""Client => `SendQueue` used by `send_message()`, until `close_send_queue()`."""
+
 class StandardClient(discord.Client):
 	"""A simple discord user designed to look after, and manage, other users."""
 
 	async def on_ready(self) -> None:
 		"""Event: Bot logged in."""
-		uux.show_info("Logged into " + self.user.name + " [" + self.user.id + "]")
+		uux.show_info("Logged into %s [%s]", self.user.name, self.user.id)
 		uux.show_list("Connected Servers", self.servers)
 
+	async def close(self) -> None:
+		"""Send the messages still queued by `send_message()`, then close the connection."""
+		await close_send_queue(self)
+		await super().close()
+
 def mentioned(client: discord.Client, message: discord.Message) -> bool:
 	"""Return true if client is mentioned in provided message.
 	This includes by name, id or mention.
@@ -27,10 +57,149 @@ async def log_message(message: discord.Message, highlight=False) -> None:
 	(uux.show_received, uux.show_received_highlighted)[highlight](str(message.author), str(message.content))
 
 async def send_message(client: discord.Client, channel: discord.Channel, message:str) -> None:
-	"""Send a message to the specified channel."""
-	try:
-		await client.send_message(channel, message)
-		uux.show_sent(str(channel), message)
-	except Exception as ex:
-		# TODO: find what exceptions will be thrown
-		uux.show_warning(ex)
+	"""Queue a message to the specified channel, see `SendQueue`.
+
+	Returns once the message is queued, waiting while the channel's queue is full."""
+	await get_send_queue(client).send(channel, message)
+
+def get_send_queue(client: discord.Client) -> SendQueue:
+	"""Return the send queue used by `send_message()` for the client, creating it on first use."""
+	queue = _send_queues.get(client)
+	if queue is None:
+		queue = _send_queues[client] = SendQueue(client)
+	return queue
+
+async def close_send_queue(client: discord.Client) -> None:
+	"""Send the messages still queued by `send_message()` for the client, then forget its send queue."""
+	queue = _send_queues.pop(client, None)
+	if queue is not None:
+		await queue.close()
+
+class TokenBucket:
+	"""Rate limiter allowing bursts of `burst` at once, refilled at `rate` per second."""
+
+	def __init__(self, rate: float, burst: int, clock=time.monotonic):
+		self.rate = rate
+		self.burst = burst
+		self.clock = clock
+		self.tokens = burst
+		self.updated = clock()
+
+	def delay(self) -> float:
+		"""Take a token if one is available and return 0, otherwise return the seconds until one is."""
+		now = self.clock()
+		self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+		if self.tokens >= 1:
+			self.tokens -= 1
+			return 0
+		return (1 - self.tokens) / self.rate
+
+	async def take(self) -> None:
+		"""Wait until a token is available, and take it."""
+		delay = self.delay()
+		while delay > 0:
+			await asyncio.sleep(delay)
+			delay = self.delay()
+
+class SendQueue:
+	"""Outbound messages of a client, sent in order from a queue per channel.
+
+	Each channel is rate limited by a `TokenBucket`, consecutive messages waiting in a queue
+	are joined into one send while they fit in `DC_MESSAGE_LIMIT`, and messages rate limited by
+	discord are sent again after the time it asks for.
+
+	Only needs the client to have `async send_message(channel, content)`, so a stand-in works."""
+
+	def __init__(self, client, rate=None, burst=None, size=None):
+		self.client = client
+		self.rate = DC_SEND_RATE if rate is None else rate
+		self.burst = DC_SEND_BURST if burst is None else burst
+		self.size = DC_QUEUE_SIZE if size is None else size
+		self.queues = {}
+		self.workers = {}
+
+	async def send(self, channel, message: str) -> None:
+		"""Queue a message to the channel, waiting while its queue is full."""
+		queue = self.queues.get(channel)
+		if queue is None:
+			queue = self.queues[channel] = asyncio.Queue(self.size)
+			self.workers[channel] = asyncio.ensure_future(self._work(channel, queue))
+
+		await queue.put(str(message))
+
+	async def join(self) -> None:
+		"""Wait until every queued message has been sent, or given up on."""
+		for queue in list(self.queues.values()):
+			await queue.join()
+
+	async def close(self) -> None:
+		"""Send every queued message, then stop."""
+		await self.join()
+		for worker in self.workers.values():
+			worker.cancel()
+		await asyncio.gather(*self.workers.values(), return_exceptions=True)
+		self.queues.clear()
+		self.workers.clear()
+
+	async def _work(self, channel, queue: asyncio.Queue) -> None:
+		"""Send the messages of a channel's queue as they arrive."""
+		bucket = TokenBucket(self.rate, self.burst)
+		carried = None
+
+		while True:
+			if carried is None:
+				messages = [await queue.get()]
+			else:
+				messages = [carried]
+				carried = None
+			length = len(messages[0])
+
+			# Short messages that queued up while waiting go out together,
+			# the first that does not fit starts the next send
+			while not queue.empty():
+				following = queue.get_nowait()
+				if length + 1 + len(following) > DC_MESSAGE_LIMIT:
+					carried = following
+					break
+				messages.append(following)
+				length += 1 + len(following)
+
+			try:
+				await bucket.take()
+				await self._deliver(channel, "\n".join(messages))
+			finally:
+				for _ in messages:
+					queue.task_done()
+
+	async def _deliver(self, channel, content: str) -> None:
+		"""Send a message, sending it again when rate limited."""
+		for attempt in range(DC_RETRIES + 1):
+			try:
+				await self.client.send_message(channel, content)
+				uux.show_sent(str(channel), content)
+				return
+			except asyncio.CancelledError:
+				raise
+			except Exception as ex:
+				retry_after = _rate_limited(ex)
+				if retry_after is None or attempt == DC_RETRIES:
+					uux.show_warning(ex)
+					return
+
+				uux.show_debug("Rate limited in %s, sending again in %.2fs", channel, retry_after)
+				await asyncio.sleep(retry_after)
+
+def _rate_limited(ex: Exception) -> float:
+	"""Return the seconds to wait if the exception is a rate limit (429) response, otherwise `None`."""
+	status = getattr(ex, "status", None)
+	if status is None:
+		status = getattr(getattr(ex, "response", None), "status", None)
+	if status != 429:
+		return None
+
+	retry_after = getattr(ex, "retry_after", None)
+	if retry_after is None:
+		return DC_RETRY_AFTER
+	return float(retry_after)
@@ -5,41 +5,200 @@ Aim is to implement equal-functionality functions, for multiple environments
 that require different implementations depending on the operating environment.
 """
 
+import os
 import sys
+import time
+import select
+import threading
+import contextlib
 
 try:
 	import msvcrt
 	windows = True
 except:
 	windows = False
+	import fcntl
+	import termios
+	import tty
+
+KEY_POLL_INTERVAL = 0.02
+"""Seconds between checks for keys in `key_events()` where keys can't be waited on, on windows."""
+
+_raw_depth = 0
+_raw_settings = None
+_raw_lock = threading.Lock()
+
+def is_terminal() -> bool:
+	"""Return true if input comes from a terminal, rather than a pipe or file."""
+	try:
+		return sys.stdin is not None and sys.stdin.isatty()
+	except ValueError:
+		# Closed stdin
+		return False
+
+@contextlib.contextmanager
+def raw_keys():
+	"""Context manager reading keys from the terminal as they are pressed, without echoing them or waiting for Enter.
+
+	Signals such as Ctrl-C still work. Can be nested, the terminal is restored once
+	the outermost exits. Does nothing on windows, or when input is not a terminal."""
+	global _raw_depth, _raw_settings
+
+	if windows or not is_terminal():
+		yield
+		return
+
+	fd = sys.stdin.fileno()
+	with _raw_lock:
+		if _raw_depth == 0:
+			_raw_settings = termios.tcgetattr(fd)
+			tty.setcbreak(fd)
+		_raw_depth += 1
+
+	try:
+		yield
+	finally:
+		with _raw_lock:
+			_raw_depth -= 1
+			if _raw_depth == 0:
+				termios.tcsetattr(fd, termios.TCSADRAIN, _raw_settings)
 
 def pause() -> None:
 	"""Pauses the application until a user enters a keypress.
 
-	On windows this will be when any character is entered, on other machines
-	Enter needs to be pressed."""
+	In a terminal this will be when any key is pressed, otherwise once Enter is pressed."""
 	if windows:
 		# Windows
 		msvcrt.getwch()
 		print()
 		return
 
-	# Other Os
+	if is_terminal():
+		get_char()
+		return
+
+	# Other input
 	input()
 
-def get_char() -> None:
+def get_char() -> str:
 	"""Get a single character from the user.
 
-	On windows this will be when any character is entered, on other machines
-	Enter needs to be pressed."""
+	In a terminal this will be when any key is pressed, special keys give their whole
+	escape sequence. Otherwise a line holding one character has to be entered."""
 	if windows:
 		# Windows
 		ch = msvcrt.getwch()
 		print()
 		return ch
 
-	# Other OS
+	if is_terminal():
+		with raw_keys():
+			return _read_key(sys.stdin.fileno())
+
+	# Other input
 	ch = input()
 	while len(ch) != 1:
 		ch = input()
 	return ch
+
+def poll_char(timeout=0) -> str:
+	"""Get a key if one is pressed within the timeout in seconds, otherwise return `None` without waiting longer.
+
+	Keys pressed while not within `raw_keys()` are only seen once Enter is pressed.
+	When input is not a terminal this waits out the timeout and returns `None`."""
+	if windows:
+		end = time.monotonic() + timeout
+		while not msvcrt.kbhit():
+			if time.monotonic() >= end:
+				return None
+			time.sleep(min(KEY_POLL_INTERVAL, max(0, end - time.monotonic())))
+		return msvcrt.getwch()
+
+	if not is_terminal():
+		# Callers wait for frames with this, returning early would have them spin
+		time.sleep(timeout)
+		return None
+
+	with raw_keys():
+		fd = sys.stdin.fileno()
+		if not select.select([fd], [], [], timeout)[0]:
+			return None
+		return _read_key(fd)
+
+async def key_events():
+	"""Asynchronously iterate keys as they are pressed, reading them raw for as long as it is iterated.
+
+	Ends when input does. Usage: `async for key in env.key_events(): ...`"""
+	import asyncio
+
+	if windows:
+		while True:
+			key = poll_char()
+			if key is None:
+				await asyncio.sleep(KEY_POLL_INTERVAL)
+			else:
+				yield key
+
+	loop = asyncio.get_running_loop()
+	keys = asyncio.Queue()
+	fd = sys.stdin.fileno()
+
+	with raw_keys():
+		loop.add_reader(fd, lambda: keys.put_nowait(_read_key(fd)))
+		try:
+			while True:
+				key = await keys.get()
+				if key == "":
+					return
+				yield key
+		finally:
+			loop.remove_reader(fd)
+
+def _read_key(fd: int) -> str:
+	"""Read a single key from a file descriptor, `""` at the end of input.
+
+	Whole utf-8 characters are read, and the escape sequences special keys send."""
+	data = os.read(fd, 1)
+	if not data:
+		return ""
+
+	lead = data[0]
+	if lead == 0x1b:
+		# Sequences arrive at once, a lone escape has nothing following it
+		while len(data) < 8 and select.select([fd], [], [], 0)[0]:
+			data += os.read(fd, 1)
+	elif lead >= 0xc0:
+		length = 2 if lead < 0xe0 else 3 if lead < 0xf0 else 4
+		while len(data) < length:
+			more = os.read(fd, length - len(data))
+			if not more:
+				break
+			data += more
+
+	return data.decode(errors="replace")
+
+def lock_file(f, shared=False) -> None:
+	"""Take an advisory lock on an open file, waiting until it is available.
+
+	Shared locks allow other shared holders, exclusive locks allow nobody else.
+	On windows every lock is exclusive."""
+	if windows:
+		f.seek(0)
+		while True:
+			try:
+				msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+				return
+			except OSError:
+				# LK_LOCK gives up after 10 seconds, keep waiting
+				time.sleep(0.1)
+
+	fcntl.flock(f.fileno(), (fcntl.LOCK_EX, fcntl.LOCK_SH)[shared])
+
+def unlock_file(f) -> None:
+	"""Release an advisory lock taken with `lock_file()`."""
+	if windows:
+		f.seek(0)
+		msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+		return
+
+	fcntl.flock(f.fileno(), fcntl.LOCK_UN)
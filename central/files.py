@@ -7,41 +7,339 @@ for common file-based tasks, such as caching, loading, saving, and others.
 
 import os
 import pickle
+import struct
+import zlib
+import lzma
+import sys
 import hashlib
+import mmap
 import shutil
-import urllib
 import pathlib
 import stat
+import time
+import threading
+import collections
+import contextlib
+import tempfile
+import json
+import concurrent.futures
+import fnmatch
+
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
 
 from . import uux
+from . import env
+from . import metrics
+
+HASH_BUFFER = 1024 * 1024
+"""Bytes read per update when hashing files too small to be memory mapped."""
+
+HASH_MMAP_MIN = 4 * 1024 * 1024
+"""Files at least this size are memory mapped for hashing instead of read."""
+
+HASH_WORKERS = None
+"""Number of files hashed in parallel, `None` for one per cpu."""
 
-def hashFile(path: str) -> str:
-	""" Get the SHA-1 hash of a file at the given path."""
+HASH_INDEX = "hash-index"
+"""Cache id of the index of known file hashes, `None` to always hash files again."""
+
+def hashFile(path: str, algorithm="sha1") -> str:
+	""" Get the SHA-1 hash of a file at the given path, or the hash of any other hashlib algorithm."""
 	if not os.path.exists(path):
 		raise FileNotFoundError
 
-	hasher = hashlib.sha1()
-	block_sz = 8192
+	hasher = hashlib.new(algorithm)
 	with open(path, 'rb') as f:
-		buf = f.read(block_sz)
-		while len(buf) > 0:
-			hasher.update(buf)
-			buf = f.read(block_sz)
+		size = os.fstat(f.fileno()).st_size
+
+		if size >= HASH_MMAP_MIN:
+			with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+				hasher.update(mapped)
+		else:
+			buf = bytearray(HASH_BUFFER)
+			view = memoryview(buf)
+			read = f.readinto(buf)
+			while read > 0:
+				hasher.update(view[:read])
+				read = f.readinto(buf)
 	return str(hasher.hexdigest())
 
+def hash_files(paths: list, algorithm="sha1", workers=None) -> dict:
+	"""Get the hashes of many files in parallel, returning a dict of path => hash.
+
+	Hashes are remembered in the `HASH_INDEX` by path, inode, size and modification time,
+	files that have not changed since they were last hashed are not read again."""
+	if workers is None:
+		workers = HASH_WORKERS
+
+	index = {}
+	if HASH_INDEX is not None:
+		index = cache_get(HASH_INDEX) or {}
+
+	hashes = {}
+	pending = {}
+	for path in paths:
+		path_stat = os.stat(path)
+		key = os.path.abspath(path)
+		identity = (path_stat.st_ino, path_stat.st_size, path_stat.st_mtime_ns)
+
+		entry = index.get(key)
+		if entry is not None and entry[0] == identity and algorithm in entry[1]:
+			hashes[path] = entry[1][algorithm]
+		else:
+			pending[path] = (key, identity)
+
+	if not pending:
+		return hashes
+
+	uux.show_debug("Hashing %d files, %d unchanged", len(pending), len(hashes))
+
+	# hashlib releases the GIL while hashing, so threads hash in parallel
+	with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+		for path, digest in zip(pending, pool.map(lambda path: hashFile(path, algorithm), pending)):
+			hashes[path] = digest
+
+	if HASH_INDEX is not None:
+		# Other processes may have updated the index meanwhile, so it is read again from disk
+		# rather than memory, and updated under its lock
+		with cache_lock(HASH_INDEX):
+			_cache_memory_remove(HASH_INDEX)
+			index = cache_get(HASH_INDEX) or {}
+			for path, (key, identity) in pending.items():
+				entry = index.get(key)
+				if entry is None or entry[0] != identity:
+					entry = index[key] = (identity, {})
+				entry[1][algorithm] = hashes[path]
+			cache_save(HASH_INDEX, index)
+
+	return hashes
+
+def hash_folder(path: str, algorithm="sha1", workers=None) -> dict:
+	"""Get the hashes of every file within a folder recursively, returning a dict of relative path => hash."""
+	paths = []
+	for root, _, names in os.walk(path):
+		for name in names:
+			paths.append(os.path.join(root, name))
+
+	hashes = hash_files(paths, algorithm, workers)
+	return {os.path.relpath(file, path): digest for file, digest in hashes.items()}
+
 def md5(string: str) -> str:
 	"""Get the md5 hash of the provided string."""
 	return str(hashlib.md5(string.encode()).hexdigest())
 
+CACHE_DIR = "Cached/"
+"""Folder the on-disk cache is kept in."""
+
+CACHE_SHARD_DEPTH = 2
+"""Number of hashed subfolder levels cache entries are spread across."""
+
+CACHE_MAX_BYTES = 0
+"""Size budget of the on-disk cache in bytes, `0` for unlimited."""
+
+CACHE_MAX_ENTRIES = 0
+"""Entry budget of the on-disk cache, `0` for unlimited."""
+
+CACHE_EVICT_RATIO = 0.9
+"""Fraction of the budget the cache is trimmed down to once the budget is exceeded."""
+
+_cache_usage = None
+"""Running `[bytes, entries]` total of the on-disk cache, `None` until the cache is first scanned."""
+
+CACHE_MEMORY_ENTRIES = 256
+"""Number of objects kept in the in-memory cache in front of the on-disk cache, `0` to disable it."""
+
+CACHE_MEMORY_BYTES = 64 * 1024 * 1024
+"""Size budget of the in-memory cache in (serialized) bytes."""
+
+CACHE_MEMORY_TTL = 300
+"""Seconds an object is served from the in-memory cache before it is read from disk again."""
+
+CACHE_SHARED = False
+"""Take advisory locks around cache reads and writes, for caches shared between processes."""
+
+CACHE_LOCK_STRIPES = 256
+"""Number of lock files the cache ids are spread across."""
+
+CACHE_FSYNC = False
+"""Flush cache writes to disk before they replace the previous entry."""
+
+_cache_locks = threading.local()
+
+_cache_memory = collections.OrderedDict()
+"""In-memory cache of id => `(expiry, size, value, serialized)`, least recently used first."""
+
+_cache_memory_size = 0
+_cache_memory_lock = threading.Lock()
+
+_cache_memory_touched = {}
+"""Id => when an object served from the in-memory cache last had its on-disk entry marked as used."""
+
+CACHE_TOUCH_INTERVAL = 60
+"""Seconds between marking the on-disk entry of an object served from the in-memory cache as recently used,
+so `cache_evict()` keeps objects that are only being read from memory."""
+
+_cache_stats = {"memory_hits": 0, "memory_misses": 0, "disk_hits": 0, "disk_misses": 0}
+
+# Objects of these types can be handed out from the in-memory cache as is,
+# anything else is kept serialized so every caller gets its own copy.
+_CACHE_IMMUTABLE = (str, bytes, int, float, bool, type(None))
+
+CACHE_COMPRESSION = "zlib"
+"""Codec cached objects are compressed with, one of `cache_codecs()`."""
+
+CACHE_COMPRESS_MIN = 512
+"""Objects that serialize to fewer bytes than this are stored uncompressed."""
+
+# Cache entry layout: magic, serializer tag, codec tag, payload.
+# Entries without the magic are plain pickles from before the format existed.
+_CACHE_MAGIC = b"CCF\x01"
+
+_cache_codecs = {}
+"""Codec name => `(tag, compress, decompress)`."""
+
+_cache_codec_tags = {}
+"""Codec tag => `decompress`."""
+
+_cache_serializers = []
+"""`(tag, accepts, encode, decode)` for each serializer, tried in order before falling back to pickle."""
+
+_cache_serializer_tags = {}
+"""Serializer tag => `decode`."""
+
+def cache_register_codec(name: str, tag: bytes, compress, decompress) -> None:
+	"""Register a compression codec for cached objects under a name and a unique single byte tag."""
+	_cache_codecs[name] = (tag, compress, decompress)
+	_cache_codec_tags[tag] = decompress
+
+def cache_register_serializer(tag: bytes, accepts, encode, decode) -> None:
+	"""Register a serializer for cached objects under a unique single byte tag.
+
+	`accepts(obj)` returns true for objects the serializer can encode to bytes,
+	`decode(data)` turns the encoded bytes back into the object."""
+	_cache_serializers.append((tag, accepts, encode, decode))
+	_cache_serializer_tags[tag] = decode
+
+def cache_codecs() -> list:
+	"""Return the names of the available compression codecs."""
+	return list(_cache_codecs)
+
+def cache_serialize(obj: object) -> bytes:
+	"""Serialize an object into the cache entry format."""
+	for tag, accepts, encode, _ in _cache_serializers:
+		if accepts(obj):
+			payload = encode(obj)
+			break
+	else:
+		tag = b"p"
+		payload = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+	codec = b"n"
+	if len(payload) >= CACHE_COMPRESS_MIN:
+		codec, compress, _ = _cache_codecs[CACHE_COMPRESSION]
+		payload = compress(payload)
+
+	return _CACHE_MAGIC + tag + codec + payload
+
+def cache_deserialize(data: bytes) -> object:
+	"""Load an object from the cache entry format, or from a plain pickle."""
+	if data[:4] != _CACHE_MAGIC:
+		return pickle.loads(data)
+
+	tag = data[4:5]
+	codec = data[5:6]
+	if tag not in _cache_serializer_tags and tag != b"p":
+		raise ValueError("Unknown cache serializer " + repr(tag))
+	if codec not in _cache_codec_tags:
+		raise ValueError("Unknown cache codec " + repr(codec))
+
+	payload = _cache_codec_tags[codec](data[6:])
+	if tag == b"p":
+		return pickle.loads(payload)
+	return _cache_serializer_tags[tag](payload)
+
+def _encode_text_list(texts: list) -> bytes:
+	"""Frame a list of strings as a count, the encoded length of each string, and the strings."""
+	encoded = [text.encode("utf-8", "surrogatepass") for text in texts]
+	lengths = struct.pack("<I" + str(len(encoded)) + "Q", len(encoded), *map(len, encoded))
+	return lengths + b"".join(encoded)
+
+def _decode_text_list(data: bytes) -> list:
+	"""Read a list of strings framed by `_encode_text_list()`."""
+	count = struct.unpack_from("<I", data)[0]
+	lengths = struct.unpack_from("<" + str(count) + "Q", data, 4)
+
+	texts = []
+	offset = 4 + count * 8
+	for length in lengths:
+		texts.append(data[offset:offset + length].decode("utf-8", "surrogatepass"))
+		offset += length
+
+	if offset != len(data):
+		raise ValueError("Cached text list is truncated")
+	return texts
+
+cache_register_codec("none", b"n", bytes, bytes)
+cache_register_codec("zlib", b"z", lambda data: zlib.compress(data, 6), zlib.decompress)
+cache_register_codec("lzma", b"x", lzma.compress, lzma.decompress)
+
+try:
+	import zstandard
+	cache_register_codec("zstd", b"Z", zstandard.ZstdCompressor().compress, zstandard.ZstdDecompressor().decompress)
+except ImportError:
+	pass
+
+cache_register_serializer(b"s", lambda obj: type(obj) is str,
+	lambda obj: obj.encode("utf-8", "surrogatepass"), lambda data: data.decode("utf-8", "surrogatepass"))
+cache_register_serializer(b"b", lambda obj: type(obj) is bytes, bytes, bytes)
+cache_register_serializer(b"l", lambda obj: type(obj) is list and all(type(text) is str for text in obj),
+	_encode_text_list, _decode_text_list)
+
+# Errors raised when loading a damaged cache entry
+_CACHE_CORRUPTION = (EOFError, pickle.UnpicklingError, ValueError, struct.error, zlib.error, lzma.LZMAError)
+
+def cache_location(item: str) -> str:
+	"""Return the location a cached object is stored at, whether or not it exists."""
+	item = str(item)
+	shard = md5(item)
+
+	location = CACHE_DIR
+	for level in range(CACHE_SHARD_DEPTH):
+		location += shard[level * 2:level * 2 + 2] + "/"
+
+	return location + item
+
 def cache_find(item: str) -> str:
 	"""Return the location of a cached object. Returns `None` when the cached object is not found."""
 	item = str(item)
-	cache = "Cached/" + item
+	cache = cache_location(item)
 
-	if os.path.exists(cache):
+	try:
+		# Touching the entry marks it as recently used for eviction
+		os.utime(cache)
+		return cache
+	except FileNotFoundError:
+		pass
+	except OSError:
 		return cache
 
-	return None
+	# Entries saved before the cache was sharded sit directly in the cache folder,
+	# move them into their shard the first time they are used.
+	legacy = CACHE_DIR + item
+	if legacy == cache or not os.path.isfile(legacy):
+		return None
+
+	os.makedirs(os.path.dirname(cache), exist_ok=True)
+	try:
+		os.replace(legacy, cache)
+	except FileNotFoundError:
+		# Another process moved it first
+		return cache_find(item) if os.path.exists(cache) else None
+	uux.show_debug("Moved cached object %s => %s", legacy, cache)
+	return cache
 
 def cache_find_hashed(item: str) -> str:
 	"""Return the location of a cached object using a hashed ID. Returns `None` when the cached object is not found."""
@@ -50,50 +348,398 @@ def cache_find_hashed(item: str) -> str:
 def cache_get(item: str) -> object:
 	"""Get an object from cache, return `None` if not found."""
 	item = str(item)
+
+	cached = _cache_memory_get(item)
+	if cached is not None:
+		_cache_stats["memory_hits"] += 1
+		metrics.count("cache_hits_total", tier="memory")
+		_cache_memory_touch(item)
+		return cached
+	_cache_stats["memory_misses"] += 1
+	metrics.count("cache_misses_total", tier="memory")
+
 	cache = cache_find(item)
 
 	# cache_find() will return none if the cache does not exist
 	# the returned location is guaranteed to exist, so no point checking again.
 
-	if cache is not None:
-		try:
-			cached = pickle.load(open(cache, "rb"))
-		except EOFError as ex:
-			# Cache file is corrupted, so print an error and act like it does
-			# not exist. We do not delete the cache file incase the user wants
-			# to recover the file.
-			uux.show_error("Error when loading file from cache: " + str(ex))
+	if cache is None:
+		_cache_stats["disk_misses"] += 1
+		metrics.count("cache_misses_total", tier="disk")
+		return None
+
+	try:
+		with cache_lock(item, shared=True) if CACHE_SHARED else contextlib.nullcontext():
+			with open(cache, "rb") as f:
+				data = f.read()
+		cached = cache_deserialize(data)
+	except FileNotFoundError:
+		# Evicted or removed by another process since it was found
+		_cache_stats["disk_misses"] += 1
+		metrics.count("cache_misses_total", tier="disk")
+		return None
+	except _CACHE_CORRUPTION as ex:
+		# Cache file is corrupted, so print an error and act like it does
+		# not exist. We do not delete the cache file incase the user wants
+		# to recover the file.
+		uux.show_error("Error when loading file from cache: " + str(ex))
+		_cache_stats["disk_misses"] += 1
+		metrics.count("cache_misses_total", tier="disk")
+		return None
+	except Exception as ex:
+		raise ex
+
+	_cache_stats["disk_hits"] += 1
+	metrics.count("cache_hits_total", tier="disk")
+	uux.show_debug("Cache hit for %s", item)
+	_cache_memory_put(item, cached, data)
+	return cached
+
+def cache_stats() -> dict:
+	"""Return the hit and miss counters of the in-memory and on-disk cache."""
+	return dict(_cache_stats)
+
+def cache_memory_clear() -> None:
+	"""Drop every object held by the in-memory cache."""
+	global _cache_memory_size
+
+	with _cache_memory_lock:
+		_cache_memory.clear()
+		_cache_memory_touched.clear()
+		_cache_memory_size = 0
+
+def _cache_memory_get(item: str) -> object:
+	"""Get an object from the in-memory cache, return `None` if not present or expired."""
+	with _cache_memory_lock:
+		entry = _cache_memory.get(item)
+		if entry is None:
 			return None
-		except Exception as ex:
-			raise ex
-		uux.show_debug("Cache hit for " + item)
-		return cached
 
-	return None
+		expiry, _, value, serialized = entry
+		if expiry < time.monotonic():
+			_cache_memory_drop(item)
+			return None
+
+		_cache_memory.move_to_end(item)
+
+	if serialized:
+		return cache_deserialize(value)
+	return value
+
+def _cache_memory_touch(item: str) -> None:
+	"""Mark the on-disk entry of an object served from the in-memory cache as recently used, at most every `CACHE_TOUCH_INTERVAL`."""
+	if not CACHE_MAX_BYTES and not CACHE_MAX_ENTRIES:
+		# Nothing is evicted without a budget
+		return
+
+	now = time.monotonic()
+	with _cache_memory_lock:
+		touched = _cache_memory_touched.get(item)
+		if touched is not None and now - touched < CACHE_TOUCH_INTERVAL:
+			return
+		_cache_memory_touched[item] = now
+
+	with contextlib.suppress(OSError):
+		os.utime(cache_location(item))
+
+def _cache_memory_put(item: str, obj: object, data: bytes) -> None:
+	"""Store an object and its serialized form in the in-memory cache."""
+	global _cache_memory_size
+
+	if not CACHE_MEMORY_ENTRIES or max(len(data), sys.getsizeof(obj)) > CACHE_MEMORY_BYTES:
+		_cache_memory_remove(item)
+		return
+
+	if isinstance(obj, _CACHE_IMMUTABLE):
+		entry = (time.monotonic() + CACHE_MEMORY_TTL, sys.getsizeof(obj), obj, False)
+	else:
+		entry = (time.monotonic() + CACHE_MEMORY_TTL, len(data), data, True)
+
+	with _cache_memory_lock:
+		_cache_memory_drop(item)
+		_cache_memory[item] = entry
+		# Its on-disk entry was just read or written
+		_cache_memory_touched[item] = time.monotonic()
+		_cache_memory_size += entry[1]
+
+		while len(_cache_memory) > CACHE_MEMORY_ENTRIES or _cache_memory_size > CACHE_MEMORY_BYTES:
+			_cache_memory_drop(next(iter(_cache_memory)))
+
+def _cache_memory_remove(item: str) -> None:
+	"""Remove an object from the in-memory cache."""
+	with _cache_memory_lock:
+		_cache_memory_drop(item)
+
+def _cache_memory_drop(item: str) -> None:
+	"""Remove an object from the in-memory cache, the caller must hold the lock."""
+	global _cache_memory_size
+
+	entry = _cache_memory.pop(item, None)
+	_cache_memory_touched.pop(item, None)
+	if entry is not None:
+		_cache_memory_size -= entry[1]
 
 def cache_create() -> None:
 	"""Creates a cache."""
-	if not os.path.exists("Cached/"):
-		os.mkdir("Cached")
+	if not os.path.exists(CACHE_DIR):
+		os.makedirs(CACHE_DIR)
 		uux.show_debug("Cache created")
 
+def cache_prepare(item: str) -> str:
+	"""Create the cache and the shard for the provided id, returning the location to store the object at."""
+	cache = cache_location(item)
+
+	cache_create()
+	os.makedirs(os.path.dirname(cache), exist_ok=True)
+
+	return cache
+
 def cache_save(item: str, obj: object) -> None:
 	"""Save an object to cache with the provided id."""
 	item = str(item)
-	cache = "Cached/" + item
+	cache = cache_prepare(item)
+	data = cache_serialize(obj)
 
-	cache_create()
+	with cache_lock(item) if CACHE_SHARED else contextlib.nullcontext():
+		previous = _file_size(cache)
+		_cache_write(cache, data)
+	uux.show_debug("Cached object to %s", cache)
+	_cache_memory_put(item, obj, data)
+
+	cache_account(len(data) - (previous or 0), int(previous is None))
+
+def cache_get_or_create(item: str, create) -> object:
+	"""Get an object from cache, or create it with the provided function and save it.
+
+	Only one process or thread creates a missing object at a time, anybody else
+	asking for the same object waits, then gets the saved object from cache.
+	No cache lock is held while creating, others only wait on `cache_create_lock()`.
+	If `create` returns `None` nothing is saved."""
+	cached = cache_get(item)
+	if cached is not None:
+		return cached
+
+	with cache_create_lock(item):
+		# Somebody else may have created it while we were waiting
+		cached = cache_get(item)
+		if cached is not None:
+			return cached
+
+		obj = create()
+		if obj is not None:
+			cache_save(item, obj)
+		return obj
+
+@contextlib.contextmanager
+def cache_create_lock(item: str):
+	"""Hold an exclusive lock for creating the provided cache id, shared between processes using the same cache.
+
+	Every id has its own lock file, removed again once released, so creating one object
+	never waits on creating another. Reentrant within a thread, like `cache_lock()`."""
+	item = str(item)
+	name = md5(item)
+
+	held = getattr(_cache_locks, "creating", None)
+	if held is None:
+		held = _cache_locks.creating = set()
+
+	if name in held:
+		yield
+		return
+
+	os.makedirs(CACHE_DIR + ".locks", exist_ok=True)
+	location = CACHE_DIR + ".locks/create-" + name
+	while True:
+		f = open(location, "a+b")
+		env.lock_file(f)
+		try:
+			if os.path.samestat(os.fstat(f.fileno()), os.stat(location)):
+				break
+		except FileNotFoundError:
+			pass
+		# The previous holder removed the file while we waited, lock the one there now
+		env.unlock_file(f)
+		f.close()
+
+	held.add(name)
+	try:
+		yield
+	finally:
+		held.discard(name)
+		with contextlib.suppress(OSError):
+			os.remove(location)
+		env.unlock_file(f)
+		f.close()
+
+@contextlib.contextmanager
+def cache_lock(item: str, shared=False):
+	"""Hold an advisory lock for the provided cache id, shared between processes using the same cache.
+
+	Locks are reentrant within a thread, a thread already holding the lock does not wait on itself."""
+	item = str(item)
+	stripe = int(md5(item)[:8], 16) % CACHE_LOCK_STRIPES
 
-	pickle.dump(obj, open(cache, "wb"))
-	uux.show_debug("Cached object to " + cache)
+	held = getattr(_cache_locks, "held", None)
+	if held is None:
+		held = _cache_locks.held = {}
+
+	if stripe in held:
+		held[stripe][1] += 1
+		try:
+			yield
+		finally:
+			held[stripe][1] -= 1
+		return
+
+	os.makedirs(CACHE_DIR + ".locks", exist_ok=True)
+	f = open(CACHE_DIR + ".locks/" + str(stripe), "a+b")
+	try:
+		env.lock_file(f, shared)
+		held[stripe] = [f, 1]
+		try:
+			yield
+		finally:
+			del held[stripe]
+			env.unlock_file(f)
+	finally:
+		f.close()
+
+def _cache_write(cache: str, data: bytes) -> None:
+	"""Atomically replace the cache entry at the provided location with the data.
+
+	The data is written to a temporary file next to the entry and renamed over it,
+	so readers never see a partially written entry."""
+	fd, temp = tempfile.mkstemp(prefix=".tmp-", dir=os.path.dirname(cache))
+
+	try:
+		with os.fdopen(fd, "wb") as f:
+			f.write(data)
+			if CACHE_FSYNC:
+				f.flush()
+				os.fsync(f.fileno())
+
+		for attempt in range(10):
+			try:
+				os.replace(temp, cache)
+				return
+			except PermissionError:
+				# Windows refuses to replace files another process has open
+				if attempt == 9:
+					raise
+				time.sleep(0.05)
+	except BaseException:
+		with contextlib.suppress(OSError):
+			os.remove(temp)
+		raise
 
 def cache_remove(item: str) -> None:
 	"""Remove an object from the cache with the provided id."""
 	item = str(item)
-	cache = "Cached/" + item
+	_cache_memory_remove(item)
+
+	for cache in (cache_location(item), CACHE_DIR + item):
+		with cache_lock(item) if CACHE_SHARED else contextlib.nullcontext():
+			size = _file_size(cache)
+			if size is not None:
+				delete_file(cache)
+		if size is not None:
+			cache_account(-size, -1)
+
+def cache_usage() -> tuple:
+	"""Return the total size in bytes, and the number of entries of the on-disk cache."""
+	global _cache_usage
+
+	if _cache_usage is None:
+		size = 0
+		entries = 0
+		for _, entry_stat in _cache_entries():
+			size += entry_stat.st_size
+			entries += 1
+		_cache_usage = [size, entries]
+
+	return tuple(_cache_usage)
+
+def cache_account(size: int, entries: int) -> None:
+	"""Record a change in size of the on-disk cache, evicting entries if the cache is over budget."""
+	if not CACHE_MAX_BYTES and not CACHE_MAX_ENTRIES:
+		return
+
+	if _cache_usage is None:
+		# The first scan already includes the change
+		cache_usage()
+	else:
+		_cache_usage[0] += size
+		_cache_usage[1] += entries
+
+	if not _cache_within_budget(_cache_usage[0], _cache_usage[1], 1):
+		cache_evict()
+
+def cache_evict() -> None:
+	"""Trim the on-disk cache down to its budget, removing the least recently used entries first."""
+	global _cache_usage
+
+	entries = sorted(_cache_entries(), key=lambda entry: entry[1].st_mtime)
+	size = sum(entry_stat.st_size for _, entry_stat in entries)
+	count = len(entries)
+	evicted = 0
+
+	for path, entry_stat in entries:
+		if _cache_within_budget(size, count, CACHE_EVICT_RATIO):
+			break
+
+		try:
+			os.remove(path)
+		except FileNotFoundError:
+			pass
+		except OSError as ex:
+			uux.show_warning("Failed to evict cached object, " + os.strerror(ex.errno))
+			continue
+
+		size -= entry_stat.st_size
+		count -= 1
+		evicted += 1
+
+	_cache_usage = [size, count]
+	uux.show_debug("Evicted %d cached objects", evicted)
+
+def _cache_within_budget(size: int, entries: int, ratio: float) -> bool:
+	"""Return true if the provided cache usage fits within the given fraction of the budget."""
+	if CACHE_MAX_BYTES and size > CACHE_MAX_BYTES * ratio:
+		return False
+	if CACHE_MAX_ENTRIES and entries > CACHE_MAX_ENTRIES * ratio:
+		return False
+	return True
+
+def _cache_entries():
+	"""Yield the location and `os.stat_result` of every entry in the on-disk cache."""
+	folders = [CACHE_DIR]
+
+	while folders:
+		try:
+			scan = os.scandir(folders.pop())
+		except FileNotFoundError:
+			continue
+
+		with scan:
+			for entry in scan:
+				if entry.name.startswith("."):
+					# Locks and partially written entries
+					continue
+				try:
+					if entry.is_dir(follow_symlinks=False):
+						folders.append(entry.path)
+					elif entry.is_file(follow_symlinks=False):
+						yield entry.path, entry.stat(follow_symlinks=False)
+				except FileNotFoundError:
+					# Removed while scanning
+					continue
 
-	if os.path.exists(cache):
-		delete_file(cache)
+def _file_size(path: str) -> int:
+	"""Return the size of the file at the provided path, or `None` if it does not exist."""
+	try:
+		return os.path.getsize(path)
+	except OSError:
+		return None
 
 def cache_get_hashed(item: str) -> object:
 	"""Get an object from cache, using a hashed ID. Returns `None` if the object isn't present."""
@@ -107,15 +753,109 @@ def cache_remove_hashed(item: str) -> None:
 	"""Delete an item from the cache, using a hashed ID."""
 	cache_remove(md5(item))
 
+def cache_get_or_create_hashed(item: str, create) -> object:
+	"""Get an object from cache using a hashed ID, or create and save it when missing."""
+	return cache_get_or_create(md5(item), create)
+
 def copy_file(file: str, dest: str) -> None:
 	"""Copy a file from one location to another."""
-	uux.show_debug("Copying " + str(file) + " => " + str(dest))
+	uux.show_debug("Copying %s => %s", file, dest)
 	shutil.copy2(file, dest)
 
+COPY_METHODS = ("reflink", "copy_file_range", "sendfile", "copy")
+"""Methods `copy_file_fast()` tries in order, "hardlink" can be added in front, see `DOWNLOAD_HARDLINK`."""
+
+# ioctl sharing the data of one file with another on copy-on-write filesystems (linux/fs.h)
+_FICLONE = 0x40049409
+
+def copy_file_fast(file: str, dest: str, methods=None) -> str:
+	"""Copy a file using the first of the methods (defaults to `COPY_METHODS`) that works, returning the method used.
+
+	"reflink" shares the data copy-on-write (btrfs, xfs), "hardlink" links the destination
+	to the same data, "copy_file_range" and "sendfile" copy without passing the data through
+	python and "copy" is a regular copy. Metadata is copied like `copy_file()`."""
+	if methods is None:
+		methods = COPY_METHODS
+
+	if os.path.isdir(dest):
+		dest = os.path.join(dest, os.path.basename(file))
+
+	if os.path.exists(dest) and os.path.samefile(file, dest):
+		return "hardlink"
+
+	for method in methods:
+		try:
+			_replace_via_temp(dest, lambda temp: _COPY_METHODS[method](file, temp))
+		except (OSError, AttributeError):
+			# Not supported by this platform or filesystem
+			continue
+
+		uux.show_debug("Copied %s => %s (%s)", file, dest, method)
+		return method
+
+	raise OSError("Unable to copy " + str(file) + " => " + str(dest))
+
+def _replace_via_temp(dest: str, write) -> None:
+	"""Create a file at a temporary path next to the destination using `write(temp)`, then move it into place."""
+	temp = os.path.join(os.path.dirname(dest), "." + os.path.basename(dest) + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp")
+
+	try:
+		write(temp)
+		os.replace(temp, dest)
+	except BaseException:
+		with contextlib.suppress(OSError):
+			os.remove(temp)
+		raise
+
+def _copy_reflink(file: str, dest: str) -> None:
+	"""Clone a file, sharing its data copy-on-write."""
+	if fcntl is None or not sys.platform.startswith("linux"):
+		raise OSError("Reflinks are not supported on " + sys.platform)
+
+	with open(file, "rb") as src, open(dest, "wb") as dst:
+		fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+	shutil.copystat(file, dest)
+
+def _copy_hardlink(file: str, dest: str) -> None:
+	"""Hard link a file to a new location."""
+	os.link(file, dest)
+
+def _copy_file_range(file: str, dest: str) -> None:
+	"""Copy a file in-kernel with `copy_file_range`."""
+	with open(file, "rb") as src, open(dest, "wb") as dst:
+		remaining = os.fstat(src.fileno()).st_size
+		while remaining > 0:
+			copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+			if copied == 0:
+				# Some filesystems (procfs, fuse) copy nothing rather than failing
+				raise OSError("copy_file_range stopped with " + str(remaining) + " bytes left of " + file)
+			remaining -= copied
+	shutil.copystat(file, dest)
+
+def _copy_sendfile(file: str, dest: str) -> None:
+	"""Copy a file in-kernel with `sendfile`."""
+	with open(file, "rb") as src, open(dest, "wb") as dst:
+		offset = 0
+		size = os.fstat(src.fileno()).st_size
+		while offset < size:
+			sent = os.sendfile(dst.fileno(), src.fileno(), offset, size - offset)
+			if sent == 0:
+				raise OSError("sendfile stopped with " + str(size - offset) + " bytes left of " + file)
+			offset += sent
+	shutil.copystat(file, dest)
+
+_COPY_METHODS = {
+	"reflink": _copy_reflink,
+	"hardlink": _copy_hardlink,
+	"copy_file_range": _copy_file_range,
+	"sendfile": _copy_sendfile,
+	"copy": shutil.copy2,
+}
+
 def mkdir(dest: str) -> None:
 	"""Create a directory at the given path. Will raise `OSError` if the directory could not be created."""
 	if not os.path.exists(dest):
-		uux.show_debug("Creating folder at " + dest)
+		uux.show_debug("Creating folder at %s", dest)
 		try:
 			os.mkdir(dest)
 		except OSError as ex:
@@ -124,7 +864,7 @@ def mkdir(dest: str) -> None:
 
 def delete_folder(path: str) -> None:
 	"""Delete the provided folder, and everything within."""
-	uux.show_info("Deleting " + path)
+	uux.show_info("Deleting %s", path)
 
 	if not os.path.exists(path):
 		# Path does not exist
@@ -137,7 +877,7 @@ def delete_folder(path: str) -> None:
 
 def delete_file(file: str) -> None:
 	"""Delete the provided file."""
-	uux.show_info("Deleting " + file)
+	uux.show_info("Deleting %s", file)
 
 	if not os.path.exists(file):
 		# Files does not exist
@@ -147,7 +887,7 @@ def delete_file(file: str) -> None:
 
 def delete_file_force(file: str) -> None:
 	"""Delete the provided file. Ignore readonly markers."""
-	uux.show_info("Forcefully Deleting " + file)
+	uux.show_info("Forcefully Deleting %s", file)
 
 	if not os.path.exists(file):
 		# Files does not exist
@@ -159,72 +899,358 @@ def delete_file_force(file: str) -> None:
 
 def copy_folder(src: str, dest: str) -> None:
 	"""Copy one folder to another including files recursively."""
-	uux.show_info("Copying folder " + src + " => " + dest)
+	uux.show_info("Copying folder %s => %s", src, dest)
 
 	if not os.path.exists(src):
 		uux.show_error("Unable to copy, '" + src + "' does not exist.")
 		return
 
-	mkdir(dest)
+	sync_folder(src, dest)
 
-	for fn in os.listdir(src):
-		if os.path.isfile(src + fn):
-			try:
-				copy_file(src + fn, dest)
-			except IOError as ex:
-				uux.show_error("Failed to copy file, " + os.strerror(ex.errno))
+SYNC_WORKERS = 8
+"""Number of files copied in parallel by `sync_folder()`."""
+
+def sync_folder(src: str, dest: str, delete=False, compare="stat", ignore=(), workers=None) -> dict:
+	"""Recursively update one folder to match another, copying only files that differ.
+
+	Files are the same when their size and modification time (to the second) match,
+	or when `compare` is "hash", when their hashes match. Changed files are copied in
+	parallel with `copy_file_fast()`. With `delete` files and folders in the destination
+	that are not in the source are removed. Names matching an `ignore` pattern are left
+	alone on both sides. Returns the number of files copied, skipped and deleted."""
+	if workers is None:
+		workers = SYNC_WORKERS
+
+	def ignored(name: str) -> bool:
+		return any(fnmatch.fnmatch(name, pattern) for pattern in ignore)
+
+	wanted = set()
+	candidates = []
+
+	for root, folders, names in os.walk(src):
+		folders[:] = [folder for folder in folders if not ignored(folder)]
+		rel = os.path.relpath(root, src)
+
+		os.makedirs(os.path.join(dest, rel), exist_ok=True)
+		wanted.update(os.path.normpath(os.path.join(rel, folder)) for folder in folders)
+
+		for name in names:
+			if not ignored(name):
+				candidates.append(os.path.normpath(os.path.join(rel, name)))
+	wanted.update(candidates)
 
-def download_file(file_url: str, location: str) -> None:
-	"""Download the provided file from a url to local location."""
+	if compare == "hash":
+		# Every file of matching size is hashed in one go, reading and writing the hash index once
+		sized = [rel for rel in candidates if _sync_same(os.path.join(src, rel), os.path.join(dest, rel), "size")]
+		hashes = hash_files([os.path.join(side, rel) for rel in sized for side in (src, dest)])
+		same = {rel for rel in sized if hashes[os.path.join(src, rel)] == hashes[os.path.join(dest, rel)]}
+		changed = [rel for rel in candidates if rel not in same]
+	else:
+		changed = [rel for rel in candidates if not _sync_same(os.path.join(src, rel), os.path.join(dest, rel), compare)]
+	summary = {"copied": 0, "skipped": len(candidates) - len(changed), "deleted": 0}
+
+	def copy(rel: str) -> bool:
+		try:
+			copy_file_fast(os.path.join(src, rel), os.path.join(dest, rel))
+			return True
+		except OSError as ex:
+			uux.show_error("Failed to copy file " + rel + ", " + str(ex))
+			return False
+
+	with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+		summary["copied"] = sum(pool.map(copy, changed))
+
+	if delete:
+		# Bottom up, so emptied folders can be removed after their files
+		for root, folders, names in os.walk(dest, topdown=False):
+			rel = os.path.relpath(root, dest)
+			for name in names:
+				path = os.path.normpath(os.path.join(rel, name))
+				if path not in wanted and not ignored(name) and not _sync_ignored_parent(path, ignored):
+					delete_file(os.path.join(dest, path))
+					summary["deleted"] += 1
+			for folder in folders:
+				path = os.path.normpath(os.path.join(rel, folder))
+				if path not in wanted and not ignored(folder) and not _sync_ignored_parent(path, ignored):
+					with contextlib.suppress(OSError):
+						# Only removed once empty, ignored files inside are kept
+						os.rmdir(os.path.join(dest, path))
+
+	uux.show_debug("Synced %s => %s: %s", src, dest, summary)
+	return summary
+
+def _sync_same(file: str, dest: str, compare: str) -> bool:
+	"""Return true if the destination file is already up to date with the source file.
+
+	With `compare` as "size" only the sizes are compared."""
+	try:
+		dest_stat = os.stat(dest)
+	except FileNotFoundError:
+		return False
+
+	file_stat = os.stat(file)
+	if file_stat.st_size != dest_stat.st_size:
+		return False
+
+	if compare == "size":
+		return True
+
+	return int(file_stat.st_mtime) == int(dest_stat.st_mtime)
+
+def _sync_ignored_parent(path: str, ignored) -> bool:
+	"""Return true if any folder along the relative path is ignored."""
+	return any(ignored(part) for part in pathlib.PurePath(path).parts[:-1])
+
+DOWNLOAD_SEGMENTS = 4
+"""Number of ranges a download is split into and fetched in parallel."""
+
+DOWNLOAD_SEGMENT_MIN = 4 * 1024 * 1024
+"""Smallest range worth its own connection, smaller files are split into fewer segments."""
+
+DOWNLOAD_BUFFER = 1024 * 1024
+"""Bytes read from the connection per write to disk."""
+
+# Ask for the file as stored, so lengths and ranges match the bytes written
+_DOWNLOAD_HEADERS = {"Accept-Encoding": "identity"}
+
+def download_file(file_url: str, location: str, segments=None) -> None:
+	"""Download the provided file from a url to local location.
+
+	If the server supports ranges the file is fetched as `segments` (defaults to
+	`DOWNLOAD_SEGMENTS`) parallel ranges, and an interrupted download resumes where
+	it left off when started again. Otherwise the file is streamed in one piece."""
 	if os.path.exists(location):
 		uux.show_warning("File exists at " + location + ", overwriting!")
 
-	uux.show_debug("Getting metadata from " + file_url)
+	if segments is None:
+		segments = DOWNLOAD_SEGMENTS
+
+	# Downloads are kept beside the destination until complete
+	partial = os.path.join(os.path.dirname(location), "." + os.path.basename(location) + ".part")
+	state_file = partial + ".state"
+
+	uux.show_debug("Getting metadata from %s", file_url)
+	info = _download_probe(file_url)
+
+	uux.show_info("Downloading %s -> %s [%s] Bytes", file_url, location, info["size"])
+
+	if info["size"] is None or not info["ranges"]:
+		_download_stream(file_url, location, partial)
+	else:
+		_download_segmented(file_url, location, partial, state_file, info, segments)
+
+	os.replace(partial, location)
+	with contextlib.suppress(FileNotFoundError):
+		os.remove(state_file)
+
+	uux.show_info("Download complete")
+
+def _download_probe(file_url: str) -> dict:
+	"""Find the size of a download, whether the server accepts ranges, and the validator of the file version."""
+	# Imported here as net imports this module, to cache pages
+	from . import net
+
+	headers = dict(_DOWNLOAD_HEADERS, Range="bytes=0-0")
+
+	with net.get_session().get(file_url, headers=headers, stream=True, timeout=net.NET_TIMEOUT) as response:
+		info = {
+			"size": None,
+			"ranges": False,
+			"validator": response.headers.get("ETag") or response.headers.get("Last-Modified"),
+		}
+
+		if response.status_code == 416:
+			# Empty files have no first byte to return
+			return info
+		response.raise_for_status()
+
+		if response.status_code == 206:
+			total = response.headers.get("Content-Range", "").rpartition("/")[2]
+			if total.isdigit():
+				info["size"] = int(total)
+				info["ranges"] = True
+		else:
+			length = response.headers.get("Content-Length", "")
+			if length.isdigit():
+				info["size"] = int(length)
 
-	u = urllib.request.urlopen(file_url)
+	return info
 
-	file_size = int(u.getheader('Content-Length'))
+def _download_stream(file_url: str, location: str, partial: str) -> None:
+	"""Download a file in a single stream, into the partial file."""
+	# Imported here as net imports this module, to cache pages
+	from . import net
 
-	uux.show_info("Downloading "+ str(file_url) + " -> " +  location + " [" + str(file_size) + "] Bytes")
+	with net.get_session().get(file_url, headers=_DOWNLOAD_HEADERS, stream=True, timeout=net.NET_TIMEOUT) as response:
+		response.raise_for_status()
 
-	with open(location, "wb") as f:
-		file_size_dl = 0
-		block_sz = 8192
+		length = response.headers.get("Content-Length", "")
+		file_size = int(length) if length.isdigit() else None
+
+		with open(partial, "wb") as f:
+			file_size_dl = 0
 
-		while True:
 			# Repeat until file downloaded
-			buffer = u.read(block_sz)
+			for buffer in response.iter_content(DOWNLOAD_BUFFER):
+				file_size_dl += len(buffer)
+				f.write(buffer)
+				_download_progress(location, file_size_dl, file_size)
 
-			if not buffer:
-				# Buffer is empty
-				break
+			_download_progress(location, file_size_dl, file_size, final=True)
 
-			# Write buffer to file
-			file_size_dl += len(buffer)
-			f.write(buffer)
+def _download_segmented(file_url: str, location: str, partial: str, state_file: str, info: dict, segments: int) -> None:
+	"""Download a file as parallel ranges into the partial file, continuing from the state file if it matches."""
+	# Imported here as net imports this module, to cache pages
+	from . import net
 
-			# Show progress
-			percentage = round(file_size_dl * 100 / file_size, 2)
-			uux.show_debug(location + " (" + f'{percentage:.2f}' + ") [ " + str(file_size_dl) + " / " + str(file_size) + " ]")
+	state = _download_load_state(state_file)
 
-	uux.show_info("Download complete")
+	if (state is None or not os.path.exists(partial)
+		or state["url"] != file_url or state["size"] != info["size"] or state["validator"] != info["validator"]):
+		count = max(1, min(segments, info["size"] // DOWNLOAD_SEGMENT_MIN))
+		bounds = [info["size"] * i // count for i in range(count + 1)]
+
+		# Each segment is [start, end, bytes done]
+		state = {
+			"url": file_url,
+			"size": info["size"],
+			"validator": info["validator"],
+			"segments": [[bounds[i], bounds[i + 1], 0] for i in range(count)],
+		}
+
+		with open(partial, "wb") as f:
+			f.truncate(info["size"])
+		_download_save_state(state_file, state)
+	else:
+		uux.show_info("Resuming download of %s", location)
+
+	lock = threading.Lock()
+	progress = [sum(segment[2] for segment in state["segments"])]
+
+	def fetch(segment: list) -> None:
+		start, end, _ = segment
+		if start + segment[2] >= end:
+			return
+
+		headers = dict(_DOWNLOAD_HEADERS, Range="bytes=" + str(start + segment[2]) + "-" + str(end - 1))
+
+		with net.get_session().get(file_url, headers=headers, stream=True, timeout=net.NET_TIMEOUT) as response:
+			if response.status_code != 206:
+				raise IOError("Server ignored range request for " + file_url + ": " + str(response.status_code))
+
+			with open(partial, "r+b") as f:
+				f.seek(start + segment[2])
+
+				for buffer in response.iter_content(DOWNLOAD_BUFFER):
+					buffer = buffer[:end - start - segment[2]]
+					f.write(buffer)
+					# Data has to be written out before the state says it is
+					f.flush()
+
+					with lock:
+						segment[2] += len(buffer)
+						progress[0] += len(buffer)
+						_download_save_state(state_file, state)
+						_download_progress(location, progress[0], info["size"])
+
+		if start + segment[2] < end:
+			raise IOError("Connection closed before the download of " + file_url + " completed")
+
+	with concurrent.futures.ThreadPoolExecutor(len(state["segments"])) as pool:
+		futures = [pool.submit(fetch, segment) for segment in state["segments"]]
+		for future in futures:
+			future.result()
+
+	_download_progress(location, progress[0], info["size"], final=True)
+
+def _download_load_state(state_file: str) -> dict:
+	"""Load the state of a partial download, `None` if there is none."""
+	try:
+		with open(state_file, "r") as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return None
+
+def _download_save_state(state_file: str, state: dict) -> None:
+	"""Atomically save the state of a partial download."""
+	temp = state_file + ".tmp"
+	with open(temp, "w") as f:
+		json.dump(state, f)
+	os.replace(temp, state_file)
+
+def _download_progress(location: str, file_size_dl: int, file_size: int, final=False) -> None:
+	"""Show the progress of a download, rate limited by `uux.show_progress()`. The final update is always shown."""
+	if file_size:
+		uux.show_progress(location, "%s (%.2f) [ %d / %d ]", location, file_size_dl * 100 / file_size, file_size_dl, file_size, final=final)
+	else:
+		uux.show_progress(location, "%s [ %d ] Bytes", location, file_size_dl, final=final)
+
+DOWNLOAD_CACHE_BY_CONTENT = False
+"""Store cached downloads by the SHA-1 of their content, so urls serving the same file share one copy."""
+
+DOWNLOAD_HARDLINK = False
+"""Deliver cached downloads as hard links where possible. Cached downloads are then made read-only,
+as changing a hard linked file changes the cached copy."""
 
 def download_file_cached(file_url: str, location: str) -> None:
-	"""Download the file from the provided url to the location. Uses the cache."""
-	item = os.path.basename(location)
+	"""Download the file from the provided url to the location. Uses the cache.
 
-	local = cache_find(item)
+	Downloads are cached by url, and delivered from cache with `copy_file_fast()`."""
+	meta = cache_get_hashed(file_url + "download")
+	local = None
+
+	if meta is not None:
+		local = cache_find(meta["item"])
+		if local is not None and _file_size(local) != meta["size"]:
+			uux.show_warning("Cached download of " + file_url + " is damaged, downloading again")
+			local = None
 
 	if local is None:
 		# Cached item doesn't exist
-		cache_create()
-		download_file(file_url, "Cached/" + item)
-		copy_file("Cached/" + item, location)
-		return
+		local = _download_to_cache(file_url)
+	else:
+		uux.show_debug("Cache hit for %s", file_url)
+
+	# Deliver file from cache to location
+	methods = COPY_METHODS
+	if DOWNLOAD_HARDLINK:
+		methods = ("reflink", "hardlink") + tuple(methods)
+	copy_file_fast(local, location, methods)
+
+def _download_to_cache(file_url: str) -> str:
+	"""Download a file into the cache and record its metadata, returning its location in the cache."""
+	item = "download-" + md5(file_url)
+	local = cache_prepare(item)
+	previous = _file_size(local)
+
+	download_file(file_url, local)
+	size = os.path.getsize(local)
+	sha1 = hashFile(local)
+
+	if DOWNLOAD_CACHE_BY_CONTENT:
+		blob = "blob-" + sha1
+		existing = cache_find(blob)
+
+		if existing is None:
+			existing = cache_prepare(blob)
+			os.replace(local, existing)
+			cache_account(size, 1)
+		else:
+			# Another url already provided the same file
+			os.remove(local)
+			if previous is not None:
+				cache_account(-previous, -1)
+
+		item = blob
+		local = existing
+	else:
+		cache_account(size - (previous or 0), int(previous is None))
+
+	if DOWNLOAD_HARDLINK:
+		os.chmod(local, stat.S_IREAD | stat.S_IRGRP | stat.S_IROTH)
 
-	# Copy file from cache to location
-	uux.show_debug("Cache hit for " + item)
-	copy_file(local, location)
+	cache_save_hashed(file_url + "download", {"url": file_url, "item": item, "size": size, "sha1": sha1})
+	return local
 
 def folder_exists(path: str) -> bool:
 	""" Return true if a folder at the provided path exists."""
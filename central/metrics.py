@@ -0,0 +1,183 @@
+"""central.metrics: Counters and timings.
+
+Lightweight instrumentation of where time goes: counters, histograms and timers,
+which can be dumped as JSON or Prometheus text at exit or on demand.
+
+Aim is to cost next to nothing while disabled, so the hot paths of net, files
+and parse can always be instrumented.
+"""
+
+import time
+import json
+import atexit
+import threading
+
+METRICS_ENABLED = False
+"""Record metrics. While disabled every recording function returns right away."""
+
+METRICS_FILE = None
+"""File a snapshot is written to at exit, Prometheus text if it ends with ".prom", otherwise JSON. `None` writes nothing."""
+
+METRICS_PREFIX = "central_"
+"""Prefix of metric names in Prometheus text."""
+
+METRICS_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+"""Upper bounds of histogram buckets, in seconds for timers."""
+
+_counters = {}
+_histograms = {}
+_lock = threading.Lock()
+
+def count(name: str, amount=1, **labels) -> None:
+	"""Add to the counter with the name and labels."""
+	if not METRICS_ENABLED:
+		return
+
+	key = (name, tuple(sorted(labels.items())))
+	with _lock:
+		_counters[key] = _counters.get(key, 0) + amount
+
+def observe(name: str, value: float, **labels) -> None:
+	"""Record a value in the histogram with the name and labels."""
+	if not METRICS_ENABLED:
+		return
+
+	key = (name, tuple(sorted(labels.items())))
+	with _lock:
+		histogram = _histograms.get(key)
+		if histogram is None:
+			histogram = _histograms[key] = {
+				"count": 0, "sum": 0, "min": value, "max": value,
+				"buckets": [0] * len(METRICS_BUCKETS)}
+
+		histogram["count"] += 1
+		histogram["sum"] += value
+		histogram["min"] = min(histogram["min"], value)
+		histogram["max"] = max(histogram["max"], value)
+
+		for index, bound in enumerate(METRICS_BUCKETS):
+			if value <= bound:
+				histogram["buckets"][index] += 1
+				break
+
+class _Timer:
+	"""Context manager observing the seconds spent within it."""
+
+	def __init__(self, name: str, labels: dict):
+		self.name = name
+		self.labels = labels
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc) -> bool:
+		observe(self.name, time.perf_counter() - self.start, **self.labels)
+		return False
+
+class _NullTimer:
+	"""Context manager doing nothing, used while metrics are disabled."""
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc) -> bool:
+		return False
+
+_NULL_TIMER = _NullTimer()
+
+def timer(name: str, **labels):
+	"""Return a context manager recording the seconds spent within it in the histogram with the name.
+
+	Usage: `with metrics.timer("net_request_seconds"): ...`"""
+	if not METRICS_ENABLED:
+		return _NULL_TIMER
+	return _Timer(name, labels)
+
+def reset() -> None:
+	"""Forget all recorded metrics."""
+	with _lock:
+		_counters.clear()
+		_histograms.clear()
+
+def snapshot() -> dict:
+	"""Return a copy of all recorded metrics as a dict of "counters" and "histograms", keyed by `name{label="value"}`."""
+	with _lock:
+		counters = {_key_name(key): value for key, value in _counters.items()}
+		histograms = {}
+		for key, histogram in _histograms.items():
+			buckets = {}
+			cumulative = 0
+			for bound, value in zip(METRICS_BUCKETS, histogram["buckets"]):
+				cumulative += value
+				buckets[str(bound)] = cumulative
+			buckets["+Inf"] = histogram["count"]
+
+			histograms[_key_name(key)] = dict(histogram, buckets=buckets)
+
+	return {"counters": counters, "histograms": histograms}
+
+def to_json() -> str:
+	"""Return a snapshot of all recorded metrics as JSON."""
+	return json.dumps(snapshot(), indent="\t")
+
+def to_prometheus() -> str:
+	"""Return a snapshot of all recorded metrics in the Prometheus text exposition format."""
+	with _lock:
+		counters = sorted(_counters.items())
+		histograms = sorted((key, dict(value, buckets=list(value["buckets"]))) for key, value in _histograms.items())
+
+	lines = []
+	typed = set()
+
+	for (name, labels), value in counters:
+		name = METRICS_PREFIX + name
+		if name not in typed:
+			typed.add(name)
+			lines.append("# TYPE " + name + " counter")
+		lines.append(name + _labels(labels) + " " + repr(value))
+
+	for (name, labels), histogram in histograms:
+		name = METRICS_PREFIX + name
+		if name not in typed:
+			typed.add(name)
+			lines.append("# TYPE " + name + " histogram")
+
+		cumulative = 0
+		for bound, value in zip(METRICS_BUCKETS, histogram["buckets"]):
+			cumulative += value
+			lines.append(name + "_bucket" + _labels(labels + (("le", str(bound)),)) + " " + str(cumulative))
+		lines.append(name + "_bucket" + _labels(labels + (("le", "+Inf"),)) + " " + str(histogram["count"]))
+		lines.append(name + "_sum" + _labels(labels) + " " + repr(histogram["sum"]))
+		lines.append(name + "_count" + _labels(labels) + " " + str(histogram["count"]))
+
+	return "\n".join(lines) + "\n"
+
+def dump(path=None) -> None:
+	"""Write a snapshot of all recorded metrics to the path (defaults to `METRICS_FILE`), see `METRICS_FILE` for the format."""
+	if path is None:
+		path = METRICS_FILE
+	if path is None:
+		return
+
+	text = to_prometheus() if str(path).endswith(".prom") else to_json()
+	with open(path, "w") as f:
+		f.write(text)
+
+def _key_name(key: tuple) -> str:
+	"""Return the `name{label="value"}` form of a metric key."""
+	name, labels = key
+	return name + _labels(labels)
+
+def _labels(labels: tuple) -> str:
+	"""Return labels in the `{label="value"}` form, empty if there are none."""
+	if not labels:
+		return ""
+	return "{" + ",".join(label + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"' for label, value in labels) + "}"
+
+def _dump_at_exit() -> None:
+	"""Write a snapshot to `METRICS_FILE` when metrics were recorded."""
+	if METRICS_ENABLED:
+		dump()
+
+atexit.register(_dump_at_exit)
@@ -6,61 +6,171 @@ Aim is to provide an array of common tasks when dealing with web resources,
 such as requests, downloads, url correction and more.
 """
 
-import requests
-import bs4
+from __future__ import annotations
+
+import time
+import typing
+import importlib.util
+import threading
 from . import uux
-from . import parse
 from . import files
+from . import urls
+from . import metrics
+
+# requests and bs4 take most of the time importing central, so they are only
+# imported by the functions using them
+if typing.TYPE_CHECKING:
+	import requests
+	import bs4
+
+NET_TIMEOUT = (10, 60)
+"""Connect and read timeouts of requests in seconds."""
+
+NET_RETRIES = 3
+"""Number of times a failed connection, or a 429/5xx response is retried."""
+
+NET_BACKOFF = 0.5
+"""Backoff factor between retries, the nth retry waits `NET_BACKOFF * 2 ** (n - 1)` seconds."""
+
+NET_POOL_HOSTS = 10
+"""Number of hosts the shared session keeps connection pools for."""
+
+NET_POOL_SIZE = 8
+"""Maximum number of connections to a single host, further requests wait for a free connection."""
+
+NET_REVALIDATE = False
+"""Check cached pages with the server before using them, once they are older than `NET_MAX_AGE`."""
+
+NET_MAX_AGE = 0
+"""Seconds a cached page is used without being revalidated."""
+
+NET_STALE_WHILE_REVALIDATE = 0
+"""Seconds past `NET_MAX_AGE` a cached page is still used as is, while it is revalidated in the background."""
+
+HTML_PARSER = None
+"""Parser soups are built with: "lxml", "html5-parser", "html5lib" or "html.parser".
+`None` uses the fastest one installed, see `get_parser()`."""
+
+HTML_PARSERS = (("lxml", "lxml"), ("html5-parser", "html5_parser"), ("html.parser", "html.parser"))
+"""Known parsers and the module each needs, fastest first."""
+
+_session = None
+_session_lock = threading.Lock()
+
+_revalidating = set()
+_revalidating_lock = threading.Lock()
+
+def create_session() -> requests.Session:
+	"""Create a session with pooled keep-alive connections and retries, using the `NET_*` settings."""
+	import requests
+	import requests.adapters
+	import urllib3.util
+
+	retry = urllib3.util.Retry(
+		total=NET_RETRIES,
+		backoff_factor=NET_BACKOFF,
+		status_forcelist=(429, 500, 502, 503, 504),
+		respect_retry_after_header=True,
+		raise_on_status=False)
+
+	adapter = requests.adapters.HTTPAdapter(
+		pool_connections=NET_POOL_HOSTS,
+		pool_maxsize=NET_POOL_SIZE,
+		pool_block=True,
+		max_retries=retry)
+
+	session = requests.Session()
+	session.mount("http://", adapter)
+	session.mount("https://", adapter)
+	return session
+
+def get_session() -> requests.Session:
+	"""Return the session shared by all requests, creating it on first use."""
+	global _session
+
+	if _session is None:
+		with _session_lock:
+			if _session is None:
+				_session = create_session()
+	return _session
+
+def set_session(session: requests.Session) -> None:
+	"""Replace the session shared by all requests. `None` creates a new default session on next use."""
+	global _session
+	_session = session
+
+def get_request(url: str, headers=None) -> requests.Response:
+	"""Request a webpage and return the request. Will return `None` if the request was invalid.
+
+	A `304 Not Modified` response to a conditional request is returned as valid."""
+	import requests
 
-def get_request(url: str) -> requests.Response:
-	"""Request a webpage and return the request. Will return `None` if the request was invalid."""
 	url = str(url)
-	uux.show_debug("Downloading '" + url + "'...", end="")
+	uux.show_debug("Downloading '%s'...", url, end="")
 
 	try:
-		response = requests.get(url)
-		if response.status_code != 200:
+		with metrics.timer("net_request_seconds"):
+			response = get_session().get(url, headers=headers, timeout=NET_TIMEOUT)
+		metrics.count("net_responses_total", status=response.status_code)
+
+		if response.status_code not in (200, 304):
 			uux.show_error("\nUnable to download '" + url + "': " + str(response.status_code))
 		else:
 			uux.show_debug("Done!")
 			return response
 	except requests.exceptions.ConnectionError:
+		metrics.count("net_errors_total", reason="connection")
 		uux.show_stack_trace()
 		uux.show_error("\nFailed to connect to '" + url + "'")
 
+	except requests.exceptions.Timeout:
+		metrics.count("net_errors_total", reason="timeout")
+		uux.show_error("\nTimed out downloading '" + url + "'")
+
 	except requests.exceptions.InvalidURL:
+		metrics.count("net_errors_total", reason="invalid_url")
 		uux.show_error("\nFailed to parse '" + url + "' as URL")
 
 	return None
 
 def correct_url(url: str) -> str:
 	"""Attempt to return a correct url from the provided one. Will return `None` if unable to correct."""
-	if url[:4] != "http":
-		url = "https://" + url
+	return urls.correct(url)
 
-	url_sections = url.split("/")
-	new_url = ""
-	for section in url_sections:
-		if section is not '':
-			new_url += section
-			if ":" in section:
-				new_url += "/"
-			new_url += "/"
+def normalize_url(url: str) -> str:
+	"""Corrects and trims the provided URL."""
+	return urls.normalize(url)
 
-	url = new_url[:-1]
+def get_parser() -> str:
+	"""Return the name of the parser soups are built with, `HTML_PARSER` or the fastest one installed."""
+	if HTML_PARSER is not None:
+		return HTML_PARSER
 
-	if parse.is_url(url):
-		return url
+	return available_parsers()[0]
 
-	# Failed
-	return None
+def available_parsers() -> list:
+	"""Return the names of the installed parsers, fastest first."""
+	parsers = []
+	for parser, module in HTML_PARSERS:
+		# html.parser comes with python
+		if module == "html.parser" or importlib.util.find_spec(module) is not None:
+			parsers.append(parser)
+	return parsers
 
-def normalize_url(url: str) -> str:
-	"""Corrects and trims the provided URL."""
-	url = correct_url(url)
-	url = url.split("#")[0]
-	url = url.split("&")[0]
-	return url
+def make_soup(markup: str, parser=None, parse_only=None) -> bs4.BeautifulSoup:
+	"""Create a soup for parsing from the provided markup, using the parser from `get_parser()` unless one is provided.
+
+	A `bs4.SoupStrainer` can be provided to only build the matching parts of the page,
+	html5-parser does not support this and always builds the whole page."""
+	if parser is None:
+		parser = get_parser()
+
+	if parser == "html5-parser":
+		import html5_parser
+		return html5_parser.parse(markup, treebuilder="soup", return_root=False)
+
+	import bs4
+	return bs4.BeautifulSoup(markup, parser, parse_only=parse_only)
 
 def get_soup(url: str) -> bs4.BeautifulSoup:
 	"""Use the url to request a webpage and create a soup for parsing. Returns `None` if the url response is invalid."""
@@ -68,30 +178,109 @@ def get_soup(url: str) -> bs4.BeautifulSoup:
 	response = get_request(url)
 	if response is None:
 		return None
-	return bs4.BeautifulSoup(response.text, "html.parser")
+	return make_soup(response.text)
 
-def get_soup_cached(url: str) -> bs4.BeautifulSoup:
+def get_soup_cached(url: str, revalidate=None) -> bs4.BeautifulSoup:
 	"""Use the url to request a webpage and create a soup for parsing. Returns `None` if the url response is invalid.
 
 	Will attempt to retrieve from cache before requesting, and will save
-	any new requests to cache
+	any new requests to cache, see `get_page_cached()`.
+	"""
+	response = get_page_cached(url, revalidate)
+	if response is None:
+		return None
+	return make_soup(response)
+
+def get_page_cached(url: str, revalidate=None) -> str:
+	"""Get the text of a webpage from cache, requesting and caching it if not present. Returns `None` if the url response is invalid.
+
+	When revalidating (defaults to `NET_REVALIDATE`) a cached page older than `NET_MAX_AGE`
+	is checked with a conditional request using its ETag and Last-Modified validators,
+	and only downloaded again if it changed. Within `NET_STALE_WHILE_REVALIDATE` of
+	expiring the cached page is used right away and checked in the background.
 	"""
 	url = normalize_url(url)
+	if revalidate is None:
+		revalidate = NET_REVALIDATE
+
+	downloaded = False
+
+	def download() -> str:
+		nonlocal downloaded
+		downloaded = True
+		return _download_page(url)
+
+	page = files.cache_get_or_create_hashed(url + "soup", download)
+	# A page downloaded by this call is as current as revalidating it would make it
+	if page is None or not revalidate or downloaded:
+		return page
+
+	validators = files.cache_get_hashed(url + "validators") or {}
+	age = time.time() - validators.get("fetched", 0)
 
-	response = files.cache_get_hashed(url + "soup")
+	if age <= NET_MAX_AGE:
+		return page
+
+	if age <= NET_MAX_AGE + NET_STALE_WHILE_REVALIDATE:
+		with _revalidating_lock:
+			if url in _revalidating:
+				return page
+			_revalidating.add(url)
+
+		def revalidate_background() -> None:
+			try:
+				_revalidate_page(url, page, validators)
+			finally:
+				with _revalidating_lock:
+					_revalidating.discard(url)
+
+		threading.Thread(target=revalidate_background, daemon=True).start()
+		return page
+
+	return _revalidate_page(url, page, validators)
+
+def _download_page(url: str) -> str:
+	"""Request a webpage, saving its validators to cache. Returns the page text, or `None` if the response is invalid."""
+	response = get_request(url)
 	if response is None:
-		response = get_request(url)
-		if response is None:
-			return None
-		response = response.text
-		files.cache_save_hashed(url + "soup", response)
-	return bs4.BeautifulSoup(response, "html.parser")
+		return None
+
+	_save_validators(url, response)
+	return response.text
+
+def _revalidate_page(url: str, page: str, validators: dict) -> str:
+	"""Check a cached page with a conditional request, returning the current page text."""
+	headers = {}
+	if validators.get("etag"):
+		headers["If-None-Match"] = validators["etag"]
+	if validators.get("last_modified"):
+		headers["If-Modified-Since"] = validators["last_modified"]
+
+	response = get_request(url, headers)
+	if response is None:
+		# Better a stale page than none at all
+		return page
+
+	if response.status_code == 304:
+		# Servers may leave the validators out of a 304
+		_save_validators(url, response, validators)
+		uux.show_debug("Cached page of '%s' is unchanged", url)
+		return page
+
+	_save_validators(url, response)
+	page = response.text
+	files.cache_save_hashed(url + "soup", page)
+	return page
 
+def _save_validators(url: str, response: requests.Response, previous=None) -> None:
+	"""Save the ETag, Last-Modified and fetch time of a response to cache, falling back to previous validators."""
+	previous = previous or {}
+	files.cache_save_hashed(url + "validators", {
+		"etag": response.headers.get("ETag", previous.get("etag")),
+		"last_modified": response.headers.get("Last-Modified", previous.get("last_modified")),
+		"fetched": time.time(),
+	})
 
 def join_url(url: str, sub_url: str) -> str:
 	"""Join a main url and a sub-url together."""
-	if sub_url in url:
-		return url
-	sub_url = sub_url.split("#")[0]
-	url = url.split("/")[2] + "/"
-	return correct_url(url + sub_url)
+	return urls.join(url, sub_url)
@@ -6,12 +6,20 @@ Aim is to provide a large Library of multiple different data formats,
 and support for parsing, checking and formatting these datatypes
 """
 
+from __future__ import annotations
+
 import re
-import bs4
+import typing
 import errno
 from . import uux
 from . import net
+from . import urls
 from . import files
+from . import metrics
+
+# bs4 is imported by the functions using it, every soup they get already needed it
+if typing.TYPE_CHECKING:
+	import bs4
 # Data Definitions
 
 ## text: Sentence
@@ -22,135 +30,364 @@ RT_SENTENCE = r"[^.!?\s][^.!?]*(?:[.!?](?!['\"]?\s|$)[^.!?]*)*[.!?]?['\"]?(?=\s|
 ## http://regexlib.com/REDetails.aspx?regexp_id=765
 RT_URL = r"^((((H|h)(T|t)|(F|f))(T|t)(P|p)((S|s)?))\:\/\/)?(www.|[a-zA-Z0-9].)[a-zA-Z0-9\-\.]+\.[a-zA-Z]{2,6}(\:[0-9]{1,5})*(\/($|[a-zA-Z0-9\.\,\;\?\'\\\+&amp;%\$#\=~_\-]+))*$"
 
+_RE_SENTENCE = re.compile(RT_SENTENCE)
+_RE_URL = re.compile(RT_URL, flags=re.RegexFlag.MULTILINE)
+
 def is_sentence(text: str) -> bool:
 	"""Return true if the provided string matches a sentence."""
-	if re.search(RT_SENTENCE, text) is None:
+	if _RE_SENTENCE.search(text) is None:
 		return False
 	return True
 
 def is_url(text: str) -> bool:
 	"""Return true if the provided string matches a URL."""
-	if re.search(RT_URL, text, flags=re.RegexFlag.MULTILINE) is None:
+	if _RE_URL.search(text) is None:
 		return False
 	return True
 
+# You never have enough: official unicode quotation marks
+_CLEANUP_QUOTES = (
+	('“', '"'), ('”', '"'), ('„', '"'), ('‟', '"'), ('⹂', '"'),
+	("‘", "'"), ("’", "'"), ("‚", "'"), ("‛", "'"),
+)
+
 def cleanup_text(text: str) -> str:
 	"""Normalize punctuation and clean up text."""
 	text = str(text)
 
-	# You never have enough: official unicode quotation marks
-	text = text.replace('“', '"').replace('”', '"')
-	text = text.replace('„', '"').replace('‟', '"')
-	text = text.replace('⹂', '"')
-	text = text.replace("‘", "'").replace("’", "'")
-	text = text.replace("‚", "'").replace("‛", "'")
+	# str.replace() runs at C speed and hands back the same string when there is
+	# nothing to replace, which beats str.translate() and regexes on large texts.
+	# Ascii text cannot hold any unicode quotation marks, and checking is free.
+	if not text.isascii():
+		for quote, plain in _CLEANUP_QUOTES:
+			text = text.replace(quote, plain)
 
+	# Each replace can create matches for the next, so the order matters
 	text = text.replace("\n.", ".").replace("...", "…")
 
-	# Add spaces after commas
-	text = text.replace(",", ", ").replace(",  ", ", ")
+	# Add spaces after commas, doubled spaces are collapsed with the rest below
+	text = text.replace(",", ", ")
 
 	# Specifically for support with uux.display_page(),
 	# move periods into quotation marks
 	text = text.replace('".', '."')
 
-	text = " ".join(text.split())
-	return text
+	return " ".join(text.split())
+
+def cleanup_texts(texts: list) -> list:
+	"""Normalize punctuation and clean up a list of texts, see `cleanup_text()`."""
+	return [cleanup_text(text) for text in texts]
+
+STORY_STRATEGIES = [
+	("threadmarks headers", "class", "message-cell--threadmark-header", "header"),
+	("threadmarks", "class", "hasThreadmark", "each"),
+	("StoryText", "class", "storytext", "first"),
+	("storycontent", "class", "storycontent", "first"),
+	("chapters", "id", "chapters", "first"),
+	("messagetext", "class", "messageText", "first"),
+	("postContent", "class", "post-content", "first"),
+	("entry", "class", "entry", "first"),
+	("messageBody", "class", "message-body", "first"),
+]
+"""Ways pages hold their content, in order of preference: `(name, attribute, value, extraction)`.
+
+A strategy matches tags whose attribute (class or id) has the value. The extraction is
+"each" for the text of every match, "first" for the text of the first match, or "header"
+for the post following each match, as threadmark headers sit above their post."""
+
+STORY_PARTIAL_PARSE = False
+"""Only build the parts of a page that content and next links are found in, see `story_soup()`."""
 
 def get_story_url_content(url:str) -> list:
 	"""Get story content from the provided url, or from cache if present."""
-	url = net.normalize_url(url)
+	record = analyse_page(url)
+	if record is None:
+		return None
+	return record["content"]
 
-	content = files.cache_get_hashed(url + "content")
+def analyse_page(url: str) -> dict:
+	"""Get everything known about the story page at the provided url, parsing the page only once.
 
-	if content is None:
-		content = story_content(net.get_soup_cached(url))
-		files.cache_save_hashed(url + "content", content)
+	Returns a dict of the page "url", its "title", the "next" page url, the content "strategy"
+	used, the "content" list and the "source" digest of the page text it was built from, or
+	`None` if the page is unavailable. Cached, and built again once the cached page changes."""
+	# Records are kept by the normalized url, links are relative to the url as requested
+	key = net.normalize_url(url)
 
-	return content
+	page = net.get_page_cached(key)
+	if page is None:
+		return None
+
+	record = cached_page_record(key, page)
+	if record is None:
+		soup = story_soup(page)
+		record = page_record(key, soup, next_story_link(soup, url), page_source(page))
+		files.cache_save_hashed(key + "page", record)
+	return record
+
+def cached_page_record(url: str, page: str) -> dict:
+	"""Return the cached record of the page at the url if it was built from the provided page text, otherwise `None`."""
+	record = files.cache_get_hashed(url + "page")
+	if record is None or record.get("source") != page_source(page):
+		return None
+	return record
+
+def page_source(page: str) -> str:
+	"""Return the digest of a page's text that page records are tied to."""
+	return files.md5(page)
+
+def page_record(url: str, soup: bs4.BeautifulSoup, next_url: str, source=None) -> dict:
+	"""Create the record `analyse_page()` returns, from the soup of the page at the url, its next link and `page_source()`."""
+	title = None
+	if soup.title is not None:
+		title = soup.title.text.strip()
+
+	strategy, content = _story_extract(soup)
+	return {"url": url, "title": title, "next": next_url, "strategy": strategy, "content": content, "source": source}
+
+def get_story_updates(url: str) -> list:
+	"""Get the chapters of the story starting at the provided url that have not been seen before.
+
+	A record of each story is kept in cache, holding a fingerprint of every chapter seen and
+	the last page reached. The first call reads the whole story, later calls check the last
+	page for changes, follow any new next links from there, and only return chapters whose
+	fingerprints are new."""
+	key = net.normalize_url(url)
+
+	story = files.cache_get_hashed(key + "story")
+	if story is None:
+		story = {"url": key, "last": url.strip(), "pages": [], "seen": []}
+	else:
+		# The last page may have grown, or gained a next link, since.
+		# Its record is built again by analyse_page() if it did
+		net.get_page_cached(story["last"], revalidate=True)
+
+	seen = set(story["seen"])
+	chapters = []
+	visited = set()
+	page_url = story["last"]
+
+	while page_url is not None and net.normalize_url(page_url) not in visited:
+		visited.add(net.normalize_url(page_url))
+
+		record = analyse_page(page_url)
+		if record is None:
+			break
+
+		if record["url"] not in story["pages"]:
+			story["pages"].append(record["url"])
+		# Kept as linked, the next page's links may be relative to it
+		story["last"] = page_url
+
+		for chapter in record["content"] or []:
+			fingerprint = files.md5(chapter)
+			if fingerprint not in seen:
+				seen.add(fingerprint)
+				chapters.append(chapter)
+
+		page_url = record["next"]
+
+	uux.show_debug("Story has %d new chapters, %d pages", len(chapters), len(story["pages"]))
+
+	story["seen"] = list(seen)
+	files.cache_save_hashed(key + "story", story)
+	return chapters
+
+def story_soup(markup: str) -> bs4.BeautifulSoup:
+	"""Create a soup of a story page for `page_record()`, `story_content()` and `next_story_link()`.
+
+	With `STORY_PARTIAL_PARSE` only the tags matching a strategy, links, the base and title and everything
+	within them are built, skipping the rest of the page."""
+	if STORY_PARTIAL_PARSE:
+		return net.make_soup(markup, parse_only=_story_strainer())
+	return net.make_soup(markup)
 
 def story_content(soup: bs4.BeautifulSoup) -> list:
 	"""Create a formatted document list from the provided soup."""
-	text = "Parse error"
-	for hr in soup.find_all("hr"):
+	return _story_extract(soup)[1]
+
+def iter_story_content(soup: bs4.BeautifulSoup):
+	"""Yield the chapters of the provided soup one at a time, as they are extracted and cleaned.
+
+	Each chapter is a dict of its "index", "title" (`None` if the page has none) and "text",
+	letting consumers start on the first chapters before the rest are extracted."""
+	strategy = _story_strategy(soup)
+	if strategy is None:
+		return
+
+	_, extraction, found = strategy
+	for index, match in enumerate(found):
+		if extraction == "header":
+			title = cleanup_text(match.text)
+			text = match.find_next(attrs={"class": "bbWrapper"}).text
+		else:
+			title = _story_title(match)
+			text = match.text
+
+		yield {"index": index, "title": title, "text": cleanup_text(text)}
+
+		if extraction == "first":
+			return
+
+def _story_extract(soup: bs4.BeautifulSoup) -> tuple:
+	"""Return the name of the strategy used, and the formatted document list from the provided soup."""
+	with metrics.timer("parse_story_content_seconds"):
+		strategy = _story_strategy(soup)
+		if strategy is None:
+			return None, None
+
+		name, extraction, found = strategy
+
+		if extraction == "first":
+			return name, [cleanup_text(found[0].text)]
+
+		if extraction == "header":
+			return name, cleanup_texts([header.find_next(attrs={"class": "bbWrapper"}).text for header in found])
+
+		return name, cleanup_texts([match.text for match in found])
+
+def _story_strategy(soup: bs4.BeautifulSoup) -> tuple:
+	"""Return the name, extraction and matching tags of the first strategy the soup matches, or `None`."""
+	matches, hrs = _story_matches(soup)
+
+	for hr in hrs:
 		hr.replace_with('\n""---------------""\n')
 
-	threadmarks = soup.find_all(attrs={"class": "hasThreadmark"})
-	threadmarkheaders = soup.find_all(attrs={"class": "message-cell--threadmark-header"})
-	storyText = soup.find_all(attrs={"class" : "storytext"})
-	storyContent = soup.find_all(attrs={"class" : "storycontent"})
-	chapters = soup.find_all(attrs={"id" : "chapters"})
-	messageText = soup.find_all(attrs={"class" : "messageText"})
-	postContent = soup.find_all(attrs={"class" : "post-content"})
-	entry = soup.find_all(attrs={"class" : "entry"})
-	messageBody = soup.find_all(attrs={"class" : "message-body"})
-
-	content = []
-
-	if threadmarkheaders:
-		# Threadmark headers are in a separate div above the one containing content
-		uux.show_debug("Page has " + str(len(threadmarkheaders)) + " threadmarks headers")
-		for header in threadmarkheaders:
-			text = cleanup_text(header.parent.find(attrs={"class":"bbWrapper"}).text)
-			content.append(text)
-
-	elif threadmarks:
-		uux.show_debug("Page has " + str(len(threadmarks)) + " threadmarks")
-		for mark in threadmarks:
-
-			text = cleanup_text(mark.text)
-			content.append(text)
-
-	elif storyText:
-		uux.show_debug("Page uses StoryText")
-		text = cleanup_text(storyText[0].text)
-		content.append(text)
-
-	elif storyContent:
-		uux.show_debug("Page uses storycontent")
-		text = cleanup_text(storyContent[0].text)
-		content.append(text)
-
-	elif chapters:
-		uux.show_debug("Page uses chapters")
-		text = cleanup_text("".join(map(str, chapters[0].text)))
-		content.append(text)
-
-	elif messageText:
-		uux.show_debug("Page uses messagetext, using first post...")
-		text = cleanup_text(messageText[0].text)
-		content.append(text)
-
-	elif postContent:
-		uux.show_debug("Page uses postContent, using first post...")
-		text = cleanup_text(postContent[0].text)
-		content.append(text)
-
-	elif entry:
-		uux.show_debug("Page uses entry, using first post...")
-		text = cleanup_text(entry[0].text)
-		content.append(text)
-
-	elif messageBody:
-		uux.show_debug("Page uses messageBody, using first post...")
-		text = cleanup_text(messageBody[0].text)
-		content.append(text)
+	for (name, _, _, extraction), found in zip(STORY_STRATEGIES, matches):
+		if found:
+			uux.show_debug("Page uses %s, %d found", name, len(found))
+			return name, extraction, found
 
-	else:
-		uux.show_error("Unable to parse page for content!")
+	uux.show_error("Unable to parse page for content!")
+	return None
+
+def _story_title(match: bs4.Tag) -> str:
+	"""Return the threadmark label within a matching tag, or `None` if it has none."""
+	marker = match.find(attrs={"class": "threadmarker"})
+	if marker is None:
 		return None
-	return content
+	return cleanup_text(marker.text).replace("Threadmark: ", "", 1)
+
+def _story_matches(soup: bs4.BeautifulSoup) -> tuple:
+	"""Walk the soup once, returning the matching tags of each strategy, and the hr tags."""
+	import bs4
+
+	classes, ids = _story_lookup()
+	matches = [[] for _ in STORY_STRATEGIES]
+	hrs = []
+
+	for tag in soup.descendants:
+		if type(tag) is not bs4.Tag:
+			continue
+
+		if tag.name == "hr":
+			hrs.append(tag)
+
+		attrs = tag.attrs
+		if not attrs:
+			continue
+
+		tag_classes = attrs.get("class")
+		if tag_classes:
+			if isinstance(tag_classes, str):
+				tag_classes = tag_classes.split()
+			for tag_class in tag_classes:
+				for index in classes.get(tag_class, ()):
+					if not matches[index] or matches[index][-1] is not tag:
+						matches[index].append(tag)
+
+		tag_id = attrs.get("id")
+		if tag_id in ids:
+			for index in ids[tag_id]:
+				matches[index].append(tag)
+
+	return matches, hrs
+
+def _story_lookup() -> tuple:
+	"""Return dicts of class => strategy indexes, and id => strategy indexes."""
+	classes = {}
+	ids = {}
+	for index, (_, attribute, value, _) in enumerate(STORY_STRATEGIES):
+		(classes, ids)[attribute == "id"].setdefault(value, []).append(index)
+	return classes, ids
+
+_StoryStrainer = None
+
+def _story_strainer() -> bs4.SoupStrainer:
+	"""Create a strainer only building the tags `page_record()` looks at, and everything within them.
+
+	The class is only defined on first use, as subclassing needs bs4 imported."""
+	global _StoryStrainer
+
+	if _StoryStrainer is None:
+		import bs4
+
+		class StoryStrainer(bs4.SoupStrainer):
+			"""Strainer of `_story_strainer()`."""
+
+			def __init__(self):
+				super().__init__(name=True)
+				self.classes, self.ids = _story_lookup()
+
+			def wanted(self, name: str, attrs: dict) -> bool:
+				"""Return true if a tag with the name and attributes is needed."""
+				if name in ("a", "base", "title"):
+					return True
+
+				tag_classes = attrs.get("class")
+				if tag_classes:
+					if isinstance(tag_classes, str):
+						tag_classes = tag_classes.split()
+					for tag_class in tag_classes:
+						# Threadmark headers are followed by their post
+						if tag_class in self.classes or tag_class == "bbWrapper":
+							return True
+
+				return attrs.get("id") in self.ids
+
+			def allow_tag_creation(self, nsprefix, name, attrs) -> bool:
+				return self.wanted(name, attrs or {})
+
+			def allow_string_creation(self, string) -> bool:
+				return False
+
+			def search_tag(self, markup_name=None, markup_attrs={}):
+				# Asked instead of allow_tag_creation() by bs4 before 4.13
+				if self.wanted(markup_name, dict(markup_attrs)):
+					return markup_name
+				return None
+
+		_StoryStrainer = StoryStrainer
+	return _StoryStrainer()
 
 def get_next_story(url:str) -> str:
 	"""Return the url of the next page in the story."""
-	soup = net.get_soup_cached(url)
+	record = analyse_page(url)
+	if record is None:
+		return None
+	return record["next"]
+
+def next_story_link(soup: bs4.BeautifulSoup, url: str) -> str:
+	"""Return the url of the next page in the story from the soup of the page at the provided url.
+
+	The url should be the page's url as requested, relative links depend on its trailing slash.
+	The link is returned as resolved, `net.normalize_url()` gives its canonical form."""
 	NEXT_LINKS = [">>", "»"]
 
-	all_links = soup.find_all("a")
-	for link in all_links:
-		for test in NEXT_LINKS:
-			if test in link.text:
-				possible_link = net.normalize_url(net.join_url(url, link.get("href")))
-				if possible_link not in url:
-					return possible_link
+	# Links are relative to the document's <base href> where it has one
+	base = soup.find("base", href=True)
+	base_url = urls.resolve(url, base["href"]) if base is not None else None
+	if base_url is None:
+		base_url = url
+
+	current = urls.normalize(url)
+	for link in soup.find_all("a", href=True):
+		if any(test in link.text for test in NEXT_LINKS):
+			possible_link = urls.resolve(base_url, link["href"])
+			if possible_link is None:
+				continue
+
+			normalized = urls.normalize(possible_link)
+			if normalized is not None and normalized != current:
+				return possible_link
 	return None
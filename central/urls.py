@@ -0,0 +1,91 @@
+"""central.urls: Url Canonicalization.
+
+Correcting, normalizing and joining urls, built on urllib.parse.
+Aim is to turn the many ways a link can be written into a single canonical url,
+quickly enough to run over every link on a page.
+"""
+
+import re
+import functools
+import urllib.parse
+
+URL_CACHE_SIZE = 8192
+"""Number of results each url function remembers."""
+
+_RE_SLASHES = re.compile(r"/{2,}")
+
+@functools.lru_cache(maxsize=URL_CACHE_SIZE)
+def correct(url: str) -> str:
+	"""Attempt to return a correct url from the provided one. Will return `None` if unable to correct.
+
+	Urls without a scheme are given https, the scheme and host are lowercased,
+	and repeated and trailing slashes are removed from the path."""
+	url = url.strip()
+	if url[:4].lower() != "http":
+		url = "https://" + url
+
+	try:
+		scheme, netloc, path, query, fragment = urllib.parse.urlsplit(url)
+	except ValueError:
+		# Invalid ports and brackets
+		return None
+
+	path = _RE_SLASHES.sub("/", path).rstrip("/")
+	url = urllib.parse.urlunsplit((scheme.lower(), netloc.lower(), path, query, fragment))
+
+	# Imported here as parse imports net, which imports this module
+	from . import parse
+	if parse.is_url(url):
+		return url
+
+	# Failed
+	return None
+
+@functools.lru_cache(maxsize=URL_CACHE_SIZE)
+def normalize(url: str) -> str:
+	"""Correct the provided url and remove its fragment. Will return `None` if unable to correct."""
+	url = correct(url)
+	if url is None:
+		return None
+	return urllib.parse.urldefrag(url)[0]
+
+@functools.lru_cache(maxsize=URL_CACHE_SIZE)
+def resolve(url: str, sub_url: str) -> str:
+	"""Resolve a link (relative, root relative or absolute) found on the page at the url, without its fragment.
+
+	Unlike `join()` the result is left as linked, keeping the trailing slash further links may be relative to.
+	Will return `None` if the link is invalid."""
+	# Correcting the url first would strip the trailing slash relative links depend on
+	base = url.strip()
+	if base[:4].lower() != "http":
+		base = "https://" + base
+	try:
+		return urllib.parse.urldefrag(urllib.parse.urljoin(base, sub_url.strip()))[0]
+	except ValueError:
+		# Invalid ports and brackets
+		return None
+
+@functools.lru_cache(maxsize=URL_CACHE_SIZE)
+def join(url: str, sub_url: str) -> str:
+	"""Resolve a link (relative, root relative or absolute) found on the page at the url. Will return `None` if unable to correct."""
+	resolved = resolve(url, sub_url)
+	if resolved is None:
+		return None
+	return correct(resolved)
+
+def normalize_links(url: str, links: list) -> list:
+	"""Resolve and normalize many links found on the page at the url, with `None` for links that are invalid."""
+	normalized = []
+	for link in links:
+		joined = None
+		if link is not None:
+			joined = join(url, link)
+		normalized.append(normalize(joined) if joined is not None else None)
+	return normalized
+
+def cache_clear() -> None:
+	"""Forget all remembered results."""
+	correct.cache_clear()
+	normalize.cache_clear()
+	resolve.cache_clear()
+	join.cache_clear()
@@ -6,16 +6,17 @@ Aim is to provide a standard set of tools to display warnings, errors,
 info messages, debug messages, error handling
 and just about anything else related to non-task output
 """
+import os
+import sys
 import time
+import atexit
+import threading
+import textwrap
 import traceback
-import bs4
 
-from colorama import Fore, Back, Style, init
-init()
+from colorama import Fore, Back, Style
 
-from . import net
 from . import env
-from . import files
 
 UUXDEBUG = True
 """Print debug messages."""
@@ -23,34 +24,144 @@ UUXDEBUG = True
 UUXINFO = True
 """ Print info messages."""
 
-def show_info(message: str, end="\n") -> None:
+UUX_FLUSH_INTERVAL = 0.05
+"""Seconds output may wait in the buffer before a background thread writes it, `0` writes every message right away.
+Warnings, errors and prompts are always written right away."""
+
+UUX_PROGRESS_INTERVAL = 0.5
+"""Minimum seconds between two updates of the same progress, see `show_progress()`."""
+
+UUX_FRAME_RATE = 30
+"""Frames per second display_page() animates text at, each frame is written at once."""
+
+UUX_TEXT_SPEED = 50
+"""Characters per second display_page() reveals while animating."""
+
+_output = []
+_output_lock = threading.Lock()
+_output_ready = threading.Event()
+_writer = None
+_writer_lock = threading.Lock()
+
+_progress = {}
+
+_colour_ready = False
+
+def init_colour() -> None:
+	""" Prepare the terminal for coloured output, done before anything is written.
+
+	Left until then as colorama wraps stdout, which scripts writing nothing don't need. """
+	global _colour_ready
+
+	if not _colour_ready:
+		import colorama
+		colorama.init()
+		_colour_ready = True
+
+def write(text: str, flush=False) -> None:
+	""" Write text to the terminal through the output buffer. """
+	with _output_lock:
+		_output.append(text)
+
+	if flush or UUX_FLUSH_INTERVAL <= 0 or not _start_writer():
+		flush_output()
+	else:
+		_output_ready.set()
+
+def flush_output() -> None:
+	""" Write everything waiting in the output buffer to the terminal. """
+	with _output_lock:
+		if not _output:
+			return
+		text = "".join(_output)
+		_output.clear()
+
+		init_colour()
+
+		# Written under the lock so concurrent flushes keep their order
+		sys.stdout.write(text)
+		sys.stdout.flush()
+
+def _start_writer() -> bool:
+	""" Start the background thread writing the output buffer, if not running.
+
+	Returns false in multiprocessing children, which write right away as they exit
+	without running atexit, so anything left in the buffer would be lost. """
+	global _writer
+
+	# Only known once the child is bootstrapped, so checked every time
+	multiprocessing = sys.modules.get("multiprocessing")
+	if multiprocessing is not None and multiprocessing.parent_process() is not None:
+		return False
+
+	if _writer is None:
+		with _writer_lock:
+			if _writer is None:
+				_writer = threading.Thread(target=_write_output, daemon=True)
+				_writer.start()
+	return True
+
+def _reset_after_fork() -> None:
+	""" Forget the writer thread and buffer of the parent in a forked child, which has neither thread nor duty to write it. """
+	global _output, _output_lock, _output_ready, _writer, _writer_lock
+
+	_output = []
+	_output_lock = threading.Lock()
+	_output_ready = threading.Event()
+	_writer = None
+	_writer_lock = threading.Lock()
+
+def _write_output() -> None:
+	""" Write the output buffer whenever it fills, batching whatever arrives within UUX_FLUSH_INTERVAL. """
+	while True:
+		_output_ready.wait()
+		time.sleep(UUX_FLUSH_INTERVAL)
+		_output_ready.clear()
+		flush_output()
+
+atexit.register(flush_output)
+if hasattr(os, "register_at_fork"):
+	os.register_at_fork(after_in_child=_reset_after_fork)
+
+def _format(message, args: tuple) -> str:
+	""" Build a message, only done once it is known to be shown.
+
+	The message can be a callable returning the message, and is %-formatted with any args. """
+	if callable(message):
+		message = message()
+	message = str(message)
+	if args:
+		message = message % args
+	return message
+
+def show_info(message: str, *args, end="\n") -> None:
 	""" Print an info message. """
 	if UUXINFO:
-		print(Fore.LIGHTCYAN_EX + str(message) + Style.RESET_ALL, end=end)
+		write(Fore.LIGHTCYAN_EX + _format(message, args) + Style.RESET_ALL + end)
 
 def show_received(sender: str, message: str) -> None:
 	""" Shows a message received from a sender"""
-	show_debug(sender + " <: " + message + Style.RESET_ALL)
+	show_debug("%s <: %s" + Style.RESET_ALL, sender, message)
 
 def show_received_highlighted(sender: str, message: str) -> None:
 	""" Shows a received message highlighted"""
-	print(Fore.LIGHTMAGENTA_EX + sender + " <: " + message + Style.RESET_ALL)
+	write(Fore.LIGHTMAGENTA_EX + sender + " <: " + message + Style.RESET_ALL + "\n")
 
 def show_sent(destination: str, message: str) -> None:
 	""" Shows a message sent to a destination"""
-	print(Fore.LIGHTCYAN_EX + destination + " :> " + Fore.LIGHTWHITE_EX + message)
+	write(Fore.LIGHTCYAN_EX + destination + " :> " + Fore.LIGHTWHITE_EX + message + "\n")
 
-def show_warning(message: str, end="\n") -> None:
+def show_warning(message: str, *args, end="\n") -> None:
 	""" Print a warning (Non-fatal) message. """
-	print(Fore.LIGHTYELLOW_EX + "? " + str(message) + Style.RESET_ALL, end=end)
+	write(Fore.LIGHTYELLOW_EX + "? " + _format(message, args) + Style.RESET_ALL + end, flush=True)
 
-def show_success(message: str, end="\n") -> None:
+def show_success(message: str, *args, end="\n") -> None:
 	""" Prints a success message """
-	print(Fore.LIGHTGREEN_EX + str(message) + Style.RESET_ALL, end=end)
+	write(Fore.LIGHTGREEN_EX + _format(message, args) + Style.RESET_ALL + end)
 
-def show_error(message: str, end="\n") -> None:
+def show_error(message: str, *args, end="\n") -> None:
 	""" Print a error (Fatal) message. """
-	print(Fore.LIGHTRED_EX + "! " + str(message) + Style.RESET_ALL, end=end)
+	write(Fore.LIGHTRED_EX + "! " + _format(message, args) + Style.RESET_ALL + end, flush=True)
 
 def show_fatal_error(message: str) -> None:
 	""" Print a error (Fatal) message, and following stacktrace. """
@@ -59,22 +170,42 @@ def show_fatal_error(message: str) -> None:
 
 def show_stack_trace() -> None:
 	""" Print a stack trace. """
-	print("\n" + Fore.LIGHTBLACK_EX + "--" * 20 + Fore.RED)
+	write("\n" + Fore.LIGHTBLACK_EX + "--" * 20 + Fore.RED + "\n", flush=True)
 	traceback.print_exc()
-	print(Fore.LIGHTBLACK_EX + "--" * 20 + "\n" + Style.RESET_ALL)
+	write(Fore.LIGHTBLACK_EX + "--" * 20 + "\n" + Style.RESET_ALL + "\n", flush=True)
 
 def show_section() -> None:
 	""" Print a section divider. """
-	print("\n" + Fore.LIGHTBLACK_EX + "--" * 20 + Style.RESET_ALL)
+	write("\n" + Fore.LIGHTBLACK_EX + "--" * 20 + Style.RESET_ALL + "\n")
+
+def show_debug(message: str, *args, end="\n") -> None:
+	""" Print a debug (low importance) message.
 
-def show_debug(message: str, end="\n") -> None:
-	""" Print a debug (low importance) message """
+	Nothing is formatted unless debug messages are shown, so pass values as %-style args,
+	or a callable for expensive messages, instead of building the message beforehand. """
 	if UUXDEBUG:
-		print(Fore.LIGHTBLACK_EX + str(message), end=end)
+		write(Fore.LIGHTBLACK_EX + _format(message, args) + end)
+
+def show_progress(key, message: str, *args, final=False) -> None:
+	""" Print a debug message about the progress of a task, at most once every UUX_PROGRESS_INTERVAL seconds.
+
+	Progress is tracked per key, the final update is always shown. """
+	if not UUXDEBUG:
+		return
+
+	now = time.monotonic()
+	if final:
+		_progress.pop(key, None)
+	elif now - _progress.get(key, -UUX_PROGRESS_INTERVAL) < UUX_PROGRESS_INTERVAL:
+		return
+	else:
+		_progress[key] = now
+
+	show_debug(message, *args)
 
 def get_input(prompt: str) -> str:
 	""" Get textual from the user. """
-	print(Fore.LIGHTMAGENTA_EX + prompt + " <: ", end="")
+	write(Fore.LIGHTMAGENTA_EX + prompt + " <: ", flush=True)
 	try:
 		inp = input()
 	except (KeyboardInterrupt, EOFError):
@@ -83,25 +214,28 @@ def get_input(prompt: str) -> str:
 
 def show_fix(fixes: list) -> None:
 	""" Shows possbible fixes to the user. """
-	print(Fore.LIGHTYELLOW_EX + "! Possible fixes: ")
+	write(Fore.LIGHTYELLOW_EX + "! Possible fixes: \n")
 	for fix in fixes:
-		print(Fore.LIGHTYELLOW_EX + "  > " + fix)
+		write(Fore.LIGHTYELLOW_EX + "  > " + fix + "\n")
 
 def show_colours() -> None:
 	"""Shows all possible colours to the user. """
 
-	print(Fore.BLACK   + "Black   " + Fore.LIGHTBLACK_EX   + "Light Black")
-	print(Fore.BLUE    + "Blue    " + Fore.LIGHTBLUE_EX    + "Light Blue")
-	print(Fore.CYAN    + "Cyan    " + Fore.LIGHTCYAN_EX    + "Light Cyan")
-	print(Fore.GREEN   + "Green   " + Fore.LIGHTGREEN_EX   + "Light Green")
-	print(Fore.MAGENTA + "Magenta " + Fore.LIGHTMAGENTA_EX + "Light Magenta")
-	print(Fore.RED     + "Red     " + Fore.LIGHTRED_EX     + "Light Red")
-	print(Fore.WHITE   + "White   " + Fore.LIGHTWHITE_EX   + "Light White")
-	print(Fore.YELLOW  + "Yellow  " + Fore.LIGHTYELLOW_EX  + "Light Yellow")
+	write(Fore.BLACK   + "Black   " + Fore.LIGHTBLACK_EX   + "Light Black\n")
+	write(Fore.BLUE    + "Blue    " + Fore.LIGHTBLUE_EX    + "Light Blue\n")
+	write(Fore.CYAN    + "Cyan    " + Fore.LIGHTCYAN_EX    + "Light Cyan\n")
+	write(Fore.GREEN   + "Green   " + Fore.LIGHTGREEN_EX   + "Light Green\n")
+	write(Fore.MAGENTA + "Magenta " + Fore.LIGHTMAGENTA_EX + "Light Magenta\n")
+	write(Fore.RED     + "Red     " + Fore.LIGHTRED_EX     + "Light Red\n")
+	write(Fore.WHITE   + "White   " + Fore.LIGHTWHITE_EX   + "Light White\n")
+	write(Fore.YELLOW  + "Yellow  " + Fore.LIGHTYELLOW_EX  + "Light Yellow\n")
 
 def get_url() -> str:
 	""" Get a validly formatted url from the user. """
 
+	# Imported here as net imports this module, to show its messages
+	from . import net
+
 	url = None
 	while url is None:
 		url = net.correct_url(get_input("Enter URL"))
@@ -113,6 +247,9 @@ def get_url() -> str:
 
 def get_args_url(argv: list, num: int) -> str:
 	"""Gets a valid url from the system arguments, otherwise prompts the user to enter one"""
+	# Imported here as net imports this module, to show its messages
+	from . import net
+
 	url = None
 	if len(argv) >= num:
 		url = net.correct_url(argv[1])
@@ -126,10 +263,13 @@ def get_args_url(argv: list, num: int) -> str:
 
 def clear_term():
 	""" Prints the terminal reset character \\033[2J """
-	print("\033[2J")
+	write("\033[2J\n", flush=True)
 
 def get_file_existing() -> str:
 	""" Gets a valid and existing file from the user """
+	# Imported here as files imports this module, to show its messages
+	from . import files
+
 	while True:
 		addr = get_input("Enter File")
 		if files.file_exists(addr):
@@ -138,6 +278,9 @@ def get_file_existing() -> str:
 
 def get_folder_existing() -> str:
 	""" Gets a valid and existing folder from the user """
+	# Imported here as files imports this module, to show its messages
+	from . import files
+
 	while True:
 		addr = get_input("Enter Folder")
 		if files.folder_exists(addr):
@@ -146,17 +289,17 @@ def get_folder_existing() -> str:
 
 def show_list(title: str, texts: list) -> None:
 	""" Shows a list of items with a title"""
-	show_info(title + ":")
+	show_info("%s:", title)
 	for item in texts:
-		show_info("  > " + str(item))
+		show_info("  > %s", item)
 
 def show_list_numbered(title: str, texts: list) -> None:
 	""" Shows a list of numbered items with a title"""
-	show_info(title + ":")
+	show_info("%s:", title)
 
 	for i in range(0, len(texts)):
 		item = texts[i]
-		show_info(" " + Fore.LIGHTMAGENTA_EX + str(i+1) + Fore.LIGHTCYAN_EX + "> " + str(item))
+		show_info(" " + Fore.LIGHTMAGENTA_EX + "%d" + Fore.LIGHTCYAN_EX + "> %s", i+1, item)
 
 def get_int(prompt: str) -> int:
 	""" Gets an integer from the user """
@@ -189,114 +332,208 @@ def select_content(content: list) -> list:
 	# Expected Content format is:
 	# content = ["content 1","Content 2"]
 
-	previews = []
-
-	for con in content:
-
-		preview = con[0:70]
-		word = preview.split(" ")
-
-		preview = preview.replace(word[0].replace(":", ""), "")
-		preview = preview.split("<<")[0].split(">>")[0]
-		preview = preview.replace(":", "")
-
-		previews.append(preview)
+	previews = [content_preview(con) for con in content]
 
 	show_list_numbered("Page Content", previews)
 	index = get_int_in_range("Select Content", 1, len(previews))
 	return index - 1
 
-def display_page(page: list, wrap: int) -> bool:
-	"""Displays an interactable listadized page"""
+def select_chapter(chapters) -> dict:
+	""" Select a chapter from those yielded by parse.iter_story_content(),
+	listing each as soon as it is extracted. Returns None if there are none. """
+	seen = []
+
+	for chapter in chapters:
+		seen.append(chapter)
+
+		# A single chapter is returned without asking, so hold back the first
+		if len(seen) == 2:
+			show_info("Page Content:")
+			show_chapter_preview(seen[0])
+		if len(seen) >= 2:
+			show_chapter_preview(chapter)
+
+	if len(seen) <= 1:
+		return (seen or [None])[0]
+
+	index = get_int_in_range("Select Content", 1, len(seen))
+	return seen[index - 1]
+
+def show_chapter_preview(chapter: dict) -> None:
+	""" Shows a numbered preview of a chapter from parse.iter_story_content() """
+	preview = chapter["title"] or content_preview(chapter["text"])
+	show_info(" " + Fore.LIGHTMAGENTA_EX + "%d" + Fore.LIGHTCYAN_EX + "> %s", chapter["index"] + 1, preview)
+
+def content_preview(content: str) -> str:
+	""" Returns a short preview of some content for listing """
+	preview = content[0:70]
+	word = preview.split(" ")
+
+	preview = preview.replace(word[0].replace(":", ""), "")
+	preview = preview.split("<<")[0].split(">>")[0]
+	preview = preview.replace(":", "")
+	return preview
+
+def display_chapters(chapters, wrap: int) -> bool:
+	"""Displays chapters from parse.iter_story_content() as they are extracted, see display_page()"""
+	def texts():
+		for chapter in chapters:
+			if chapter["title"]:
+				show_info("%s", chapter["title"])
+			yield chapter["text"]
+
+	return display_page(texts(), wrap)
+
+def display_page(page, wrap: int) -> bool:
+	"""Displays an interactable listadized page.
+
+	The page can be any iterable of texts, each is only read once the previous is displayed.
+	Texts are wrapped once into lines, and revealed a frame at a time while animating."""
 	if wrap == 0:
 		wrap = 100
 	quote = False
-	stop = False
 	lineNo = 0
 
 	# Options
 	animate = True
 
-	for i in range(0,len(page)):
-		text = page[i]
-		text = text.replace(".)", ").").replace(".\"", "\".")
-		text = text.replace(".]", "].")
-		page[i] = text
-
 	# Display option state
 	def show_options():
-		print(Fore.LIGHTBLACK_EX)
-		print("Options[ ", end="")
-		print("1: Options | ", end="")
-		print("2: " + (Fore.RED,Fore.LIGHTYELLOW_EX)[animate] + "Animate" + Fore.LIGHTBLACK_EX + " | ", end="")
-		print("8: Skip | ", end="")
-		print("0: Exit", end="")
-		print(Fore.LIGHTBLACK_EX + " ]" + Fore.RESET+"\n")
+		write(Fore.LIGHTBLACK_EX + "\n"
+			+ "Options[ "
+			+ "1: Options | "
+			+ "2: " + (Fore.RED,Fore.LIGHTYELLOW_EX)[animate] + "Animate" + Fore.LIGHTBLACK_EX + " | "
+			+ "8: Skip | "
+			+ "0: Exit"
+			+ Fore.LIGHTBLACK_EX + " ]" + Fore.RESET + "\n\n", flush=True)
+
+	# Acts on option keys, returning True to skip, False to exit, and None otherwise
+	def handle_key(ch):
+		nonlocal animate
+
+		if ch == "8":
+			show_warning("SKIPPED")
+			write(Fore.RESET + "\n", flush=True)
+			return True
+
+		elif ch == "0":
+			show_error("EXIT")
+			write(Fore.RESET + "\n", flush=True)
+			return False
+
+		elif ch == "2":
+			animate = not animate
+			show_options()
+
+		elif ch == "1":
+			show_options()
 
+		return None
 
+	flush_output()
+	init_colour()
 	show_options()
-	for line in page:
-		caret = 0
-
-		for character in line:
-			print((Fore.RESET,Fore.LIGHTGREEN_EX)[quote], end="")
-
-			sleepTime = (0, 0.02)[animate]
 
-			time.sleep(sleepTime)
+	# Keys are read as pressed, so options work while text is being animated
+	with env.raw_keys():
+		for line in page:
+			# Pulling the line may have shown messages, see display_chapters()
+			flush_output()
+			line = line.replace(".)", ").").replace(".\"", "\".")
+			line = line.replace(".]", "].")
+			colour = (Fore.RESET,Fore.LIGHTGREEN_EX)[quote]
+
+			for piece in wrap_page_text(line, wrap):
+				result = render_text(colour, piece, animate, handle_key)
+				if result is not None:
+					return result
+
+				if piece == "\n":
+					lineNo+=1
+
+				elif piece.endswith(". "):
+					lineNo+=1
+
+					while True:
+						ch = env.get_char()
+						result = handle_key(ch)
+						if result is not None:
+							return result
+
+						if ch not in ("1", "2"):
+							break
+
+					if lineNo > 20:
+						clear_term()
+						lineNo = 0
+
+			quote = not quote
+			env.pause()
+			if lineNo > 10:
+				clear_term()
+				lineNo = 0
 
-			if character == ".":
-
-				print(". ", end="")
-				caret = 0
-				lineNo+=1
-
-				while True:
-					ch = env.get_char()
-
-					if ch == "8":
-						show_warning("SKIPPED")
-						print(Fore.RESET)
-						return True
-
-					elif ch == "0":
-						show_error("EXIT")
-						print(Fore.RESET)
-						return False
-
-					elif ch == "2":
-						animate = not animate
-						show_options()
-
-					elif ch == "1":
-						show_options()
-
-					else:
-						break
-
-				if lineNo > 20:
-					clear_term()
-					lineNo = 0
+	return True
 
-			elif character == "…":
-				for i in range(0, 3):
-					print(".", end="")
-					time.sleep(sleepTime/2)
+def wrap_page_text(text: str, wrap: int) -> list:
+	"""Wraps a text of display_page() into pieces to show, each ending a sentence, or a "\\n" between lines.
+
+	Sentences keep the space after them as ". ", at the end of the text one is added.
+	Texts only a little longer than the wrap are left whole, wrapped lines after the first are indented."""
+	if len(text) > wrap + (wrap / 5):
+		lines = textwrap.wrap(text, wrap, subsequent_indent="  ", break_long_words=False, break_on_hyphens=False)
+	else:
+		lines = [text]
+
+	pieces = []
+	for number, line in enumerate(lines):
+		if number:
+			pieces.append("\n")
+
+		start = 0
+		end = line.find(".")
+		while end != -1:
+			if end + 1 == len(line) or line[end + 1] == " ":
+				# Sentences end with a space, the next text follows on without one
+				pieces.append(line[start:end + 1] + " ")
+				start = end + 2
 			else:
-				print(character, end="")
+				pieces.append(line[start:end + 1])
+				start = end + 1
+			end = line.find(".", start)
+
+		if start < len(line):
+			pieces.append(line[start:])
+	return pieces
 
-			caret += 1
+def render_text(colour: str, text: str, animate: bool, on_key=None) -> object:
+	"""Writes text in a colour, revealing it at UUX_TEXT_SPEED a frame at a time when animating.
 
-			if (caret > wrap and len(line) > (wrap + (wrap / 5))) and character == " ":
-				print()
-				print("  ", end="")
-				caret = 0
-				lineNo+=1
+	Keys pressed while animating are given to on_key as soon as they are pressed, if it
+	returns anything but None the text is left unfinished and that is returned."""
+	if not animate or UUX_TEXT_SPEED <= 0:
+		write(colour + text.replace("…", "..."), flush=True)
+		return None
 
-		quote = not quote
-		env.pause()
-		if lineNo > 10:
-			clear_term()
-			lineNo = 0
+	frame = 1 / UUX_FRAME_RATE
+	start = time.monotonic()
+	next_frame = start
+	shown = 0
 
-	return True
+	while True:
+		due = min(len(text), int((time.monotonic() - start) * UUX_TEXT_SPEED) + 1)
+		if due > shown:
+			# Colour is given again each frame, anything may have been written in between
+			write(colour + text[shown:due].replace("…", "..."), flush=True)
+			shown = due
+
+		if shown == len(text):
+			return None
+
+		# Waiting for the next frame is waiting for keys
+		next_frame += frame
+		ch = env.poll_char(max(0, next_frame - time.monotonic()))
+		if ch is not None and on_key is not None:
+			result = on_key(ch)
+			if result is not None:
+				return result
@@ -11,7 +11,7 @@ def main(instDir: str) -> None:
 	if instDir == "":
 		uux.show_error("Invalid directory")
 	try:
-		files.copy_folder("central/", instDir)
+		files.sync_folder("central/", instDir, delete=True, ignore=["__pycache__", "*.pyc"])
 	except:
 		return
 
@@ -0,0 +1,69 @@
+# The on-disk cache behind the in-memory cache: eviction order and the hash index
+
+import os
+
+import pytest
+
+from central import files
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+	monkeypatch.setattr(files, "CACHE_DIR", str(tmp_path) + "/")
+	monkeypatch.setattr(files, "_cache_usage", None)
+	files.cache_memory_clear()
+	yield
+	files.cache_memory_clear()
+
+def age(item: str, seconds: float) -> None:
+	"""Make the on-disk entry of an object look last used the provided seconds ago."""
+	location = files.cache_location(item)
+	when = os.stat(location).st_mtime - seconds
+	os.utime(location, (when, when))
+
+def test_memory_hits_keep_entries(cache, monkeypatch):
+	monkeypatch.setattr(files, "CACHE_MAX_ENTRIES", 3)
+	monkeypatch.setattr(files, "CACHE_TOUCH_INTERVAL", 0)
+
+	for item in ["used", "old", "older"]:
+		files.cache_save(item, item * 100)
+	age("used", 300)
+	age("old", 200)
+	age("older", 100)
+
+	# Served from memory, only its on-disk entry says it was used
+	assert files.cache_get("used") == "used" * 100
+	monkeypatch.setattr(files, "CACHE_MAX_ENTRIES", 2)
+	files.cache_evict()
+
+	assert files.cache_find("used") is not None
+	assert files.cache_find("old") is None
+
+def test_touches_are_rate_limited(cache, monkeypatch):
+	monkeypatch.setattr(files, "CACHE_MAX_ENTRIES", 10)
+	files.cache_save("item", "value")
+	age("item", 300)
+	before = os.stat(files.cache_location("item")).st_mtime
+
+	# Saved just now, so the entry counts as recently marked
+	assert files.cache_get("item") == "value"
+	assert os.stat(files.cache_location("item")).st_mtime == before
+
+	monkeypatch.setattr(files, "CACHE_TOUCH_INTERVAL", 0)
+	assert files.cache_get("item") == "value"
+	assert os.stat(files.cache_location("item")).st_mtime > before
+
+def test_hash_index_keeps_entries_of_other_processes(cache, tmp_path):
+	first = tmp_path / "first.txt"
+	second = tmp_path / "second.txt"
+	first.write_text("first")
+	second.write_text("second")
+	files.hash_files([str(first)])
+
+	# Another process adds to the index on disk, this one still holds the index in memory
+	index = files.cache_get(files.HASH_INDEX)
+	index["/elsewhere"] = ((1, 2, 3), {"sha1": "0" * 40})
+	files._cache_write(files.cache_location(files.HASH_INDEX), files.cache_serialize(index))
+
+	files.hash_files([str(second)])
+	files.cache_memory_clear()
+	assert set(files.cache_get(files.HASH_INDEX)) == {str(first), str(second), "/elsewhere"}
@@ -0,0 +1,74 @@
+# cleanup_text against a fixed corpus, and against the original implementation on random texts
+
+import random
+
+import pytest
+
+from central import parse
+
+def original_cleanup_text(text: str) -> str:
+	"""cleanup_text as it was before its passes were trimmed, the reference for the random texts."""
+	text = str(text)
+
+	text = text.replace('“', '"').replace('”', '"')
+	text = text.replace('„', '"').replace('‟', '"')
+	text = text.replace('⹂', '"')
+	text = text.replace("‘", "'").replace("’", "'")
+	text = text.replace("‚", "'").replace("‛", "'")
+
+	text = text.replace("\n.", ".").replace("...", "…")
+
+	text = text.replace(",", ", ").replace(",  ", ", ")
+
+	text = text.replace('".', '."')
+
+	text = " ".join(text.split())
+	return text
+
+CORPUS = [
+	("", ""),
+	("plain text", "plain text"),
+	("  spaced \t out\n\ntext  ", "spaced out text"),
+	("“Hello there”", '"Hello there"'),
+	("„Low‟ and ⹂double⹂", '"Low" and "double"'),
+	("‘single’ ‚low‛", "'single' 'low'"),
+	("“General Kenobi”.", '"General Kenobi."'),
+	('"quoted".', '"quoted."'),
+	("Wait...", "Wait…"),
+	("Wait....", "Wait…."),
+	("Ends\n.", "Ends."),
+	("Ends\n..", "Ends.."),
+	("Line\n...", "Line…"),
+	("\n...", "…"),
+	("a,b", "a, b"),
+	("a, b", "a, b"),
+	("a,  b", "a, b"),
+	("a,,b", "a, , b"),
+	("a , ,b", "a , , b"),
+	("a,\nb", "a, b"),
+	('"One",said "two".', '"One", said "two."'),
+	("“Wait...”.", '"Wait…."'),
+	("x\n\".", 'x ."'),
+]
+
+@pytest.mark.parametrize("text, expected", CORPUS)
+def test_corpus(text, expected):
+	assert parse.cleanup_text(text) == expected
+	assert original_cleanup_text(text) == expected
+
+# Pieces random texts are built from, chosen to interact with each other's replacements
+PIECES = ["a", "word", " ", "  ", "\t", "\n", ".", "..", "...", ",", ", ", ",  ", '"', "'",
+	"“", "”", "„", "‟", "⹂", "‘", "’", "‚", "‛", "…", "!", "?", "é"]
+
+def test_random_matches_original():
+	rng = random.Random(1742)
+	for _ in range(20000):
+		text = "".join(rng.choice(PIECES) for _ in range(rng.randint(0, 24)))
+		assert parse.cleanup_text(text) == original_cleanup_text(text), repr(text)
+
+def test_cleanup_texts():
+	texts = ["a,b", "“c”.", ""]
+	assert parse.cleanup_texts(texts) == [original_cleanup_text(text) for text in texts]
+
+def test_not_a_string():
+	assert parse.cleanup_text(12) == "12"
@@ -0,0 +1,43 @@
+# copy_file_fast giving up on in-kernel copies that stop early, rather than leaving a short file
+
+import os
+
+import pytest
+
+from central import files
+
+@pytest.mark.parametrize("method, name", [("copy_file_range", "copy_file_range"), ("sendfile", "sendfile")])
+def test_fails_when_nothing_is_copied(tmp_path, monkeypatch, method, name):
+	if not hasattr(os, name):
+		pytest.skip(name + " is not available")
+	# Like procfs and some fuse filesystems, which copy nothing rather than failing
+	monkeypatch.setattr(os, name, lambda *args: 0)
+
+	src = tmp_path / "src.bin"
+	src.write_bytes(b"data" * 5000)
+	dest = tmp_path / "dest.bin"
+
+	# shutil copies with sendfile too, so the fallback can't be checked with it patched
+	with pytest.raises(OSError):
+		files.copy_file_fast(str(src), str(dest), (method,))
+	assert sorted(os.listdir(tmp_path)) == ["src.bin"]
+
+def test_copies(tmp_path):
+	src = tmp_path / "src.bin"
+	src.write_bytes(b"data" * 5000)
+	dest = tmp_path / "dest.bin"
+
+	files.copy_file_fast(str(src), str(dest))
+	assert dest.read_bytes() == src.read_bytes()
+
+def test_falls_back_to_next_method(tmp_path, monkeypatch):
+	if not hasattr(os, "copy_file_range"):
+		pytest.skip("copy_file_range is not available")
+	monkeypatch.setattr(os, "copy_file_range", lambda *args: 0)
+
+	src = tmp_path / "src.bin"
+	src.write_bytes(b"data" * 5000)
+	dest = tmp_path / "dest.bin"
+
+	assert files.copy_file_fast(str(src), str(dest), ("copy_file_range", "copy")) == "copy"
+	assert dest.read_bytes() == src.read_bytes()
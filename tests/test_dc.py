@@ -0,0 +1,137 @@
+# SendQueue against a stand-in client: coalescing, rate limit retries, backpressure and closing
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("discord")
+
+from central import dc
+
+class RateLimited(Exception):
+	"""Shaped like the 429 errors discord raises."""
+
+	status = 429
+
+	def __init__(self, retry_after):
+		super().__init__("429 Too Many Requests")
+		self.retry_after = retry_after
+
+class FakeClient:
+	"""Records what it sends, failing with the errors queued in `failures` first."""
+
+	def __init__(self):
+		self.sent = []
+		self.attempts = 0
+		self.failures = []
+
+	async def send_message(self, channel, content: str) -> None:
+		self.attempts += 1
+		if self.failures:
+			raise self.failures.pop(0)
+		self.sent.append((channel, content))
+
+def test_coalesces_queued_messages():
+	async def run():
+		client = FakeClient()
+		queue = dc.SendQueue(client, rate=1000, burst=1000)
+		for message in ["one", "two", "three"]:
+			await queue.send("general", message)
+		await queue.send("other", "four")
+		await queue.close()
+		return client
+
+	client = asyncio.run(run())
+	assert sorted(client.sent) == [("general", "one\ntwo\nthree"), ("other", "four")]
+
+def test_coalescing_respects_message_limit(monkeypatch):
+	monkeypatch.setattr(dc, "DC_MESSAGE_LIMIT", 10)
+
+	async def run():
+		client = FakeClient()
+		queue = dc.SendQueue(client, rate=1000, burst=1000)
+		for message in ["aaaa", "bbbb", "cccccccc", "dd"]:
+			await queue.send("general", message)
+		await queue.close()
+		return client
+
+	client = asyncio.run(run())
+	assert [content for _, content in client.sent] == ["aaaa\nbbbb", "cccccccc", "dd"]
+
+def test_retries_when_rate_limited():
+	async def run():
+		client = FakeClient()
+		client.failures = [RateLimited(0.01), RateLimited(0.01)]
+		queue = dc.SendQueue(client, rate=1000, burst=1000)
+		await queue.send("general", "hello")
+		await queue.close()
+		return client
+
+	client = asyncio.run(run())
+	assert client.attempts == 3
+	assert client.sent == [("general", "hello")]
+
+def test_gives_up_after_retries(monkeypatch):
+	monkeypatch.setattr(dc, "DC_RETRIES", 1)
+
+	async def run():
+		client = FakeClient()
+		client.failures = [RateLimited(0), RateLimited(0)]
+		queue = dc.SendQueue(client, rate=1000, burst=1000)
+		await queue.send("general", "dropped")
+		await queue.join()
+		await queue.send("general", "kept")
+		await queue.close()
+		return client
+
+	client = asyncio.run(run())
+	assert client.attempts == 3
+	assert client.sent == [("general", "kept")]
+
+def test_send_waits_while_queue_is_full():
+	async def run():
+		client = FakeClient()
+		# One token and a tiny refill rate, the worker is held back after the first send
+		queue = dc.SendQueue(client, rate=0.001, burst=1, size=1)
+		await queue.send("general", "first")
+		await asyncio.sleep(0)
+		await queue.send("general", "second")
+		await asyncio.sleep(0)
+		# The worker waits for a token with the second, the third fills the queue
+		await queue.send("general", "third")
+
+		blocked = asyncio.ensure_future(queue.send("general", "fourth"))
+		await asyncio.sleep(0.05)
+		done = blocked.done()
+		blocked.cancel()
+		for worker in queue.workers.values():
+			worker.cancel()
+		await asyncio.gather(blocked, *queue.workers.values(), return_exceptions=True)
+		return client, done
+
+	client, done = asyncio.run(run())
+	assert client.sent == [("general", "first")]
+	assert not done
+
+def test_token_bucket():
+	now = [0.0]
+	bucket = dc.TokenBucket(rate=2, burst=2, clock=lambda: now[0])
+	assert bucket.delay() == 0
+	assert bucket.delay() == 0
+	assert bucket.delay() == pytest.approx(0.5)
+	now[0] = 0.5
+	assert bucket.delay() == 0
+	now[0] = 10
+	assert [bucket.delay() for _ in range(3)] == [0, 0, pytest.approx(0.5)]
+
+def test_close_send_queue_forgets_client():
+	async def run():
+		client = FakeClient()
+		await dc.send_message(client, "general", "bye")
+		assert client in dc._send_queues
+		await dc.close_send_queue(client)
+		return client
+
+	client = asyncio.run(run())
+	assert client.sent == [("general", "bye")]
+	assert client not in dc._send_queues
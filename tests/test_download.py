@@ -0,0 +1,149 @@
+# Downloads against the local bench server: segmented, streamed, empty and resumed
+
+import os
+import threading
+
+import pytest
+
+import server
+from central import files
+
+class RecordingHandler(server.Handler):
+	"""Records the Range header of every GET it serves."""
+
+	def do_GET(self) -> None:
+		with self.server.lock:
+			self.server.ranges.append(self.headers.get("Range"))
+		super().do_GET()
+
+class PlainHandler(server.Handler):
+	"""Ignores ranges and sends no Content-Length, the body ends when the connection closes."""
+
+	protocol_version = "HTTP/1.0"
+
+	def do_GET(self) -> None:
+		with open(os.path.join(self.server.root, self.path.lstrip("/")), "rb") as f:
+			data = f.read()
+		self.send_response(200)
+		self.end_headers()
+		self.wfile.write(data)
+
+def serve(root, handler):
+	httpd, base_url = server.start(str(root), handler)
+	httpd.ranges = []
+	httpd.lock = threading.Lock()
+	return httpd, base_url
+
+@pytest.fixture
+def served(tmp_path):
+	root = tmp_path / "served"
+	root.mkdir()
+	servers = []
+
+	def start(handler=RecordingHandler):
+		httpd, base_url = serve(root, handler)
+		servers.append(httpd)
+		return root, httpd, base_url
+
+	yield start
+	for httpd in servers:
+		httpd.shutdown()
+		httpd.server_close()
+
+@pytest.fixture
+def small_segments(monkeypatch):
+	# Small files are split too, rather than needing megabytes per segment
+	monkeypatch.setattr(files, "DOWNLOAD_SEGMENT_MIN", 1024)
+	monkeypatch.setattr(files, "DOWNLOAD_BUFFER", 4096)
+
+def content(size: int) -> bytes:
+	return bytes(i * 7 % 251 for i in range(size))
+
+def test_segmented(served, tmp_path, small_segments):
+	root, httpd, base_url = served()
+	data = content(100000)
+	(root / "file.bin").write_bytes(data)
+
+	location = str(tmp_path / "file.bin")
+	files.download_file(base_url + "file.bin", location, segments=4)
+
+	with open(location, "rb") as f:
+		assert f.read() == data
+	# The one byte probe, then a range for each segment
+	assert httpd.ranges[0] == "bytes=0-0"
+	assert sorted(httpd.ranges[1:]) == sorted(["bytes=0-24999", "bytes=25000-49999", "bytes=50000-74999", "bytes=75000-99999"])
+	assert not os.path.exists(str(tmp_path / ".file.bin.part"))
+	assert not os.path.exists(str(tmp_path / ".file.bin.part.state"))
+
+def test_stream_without_length_or_ranges(served, tmp_path, small_segments):
+	root, httpd, base_url = served(PlainHandler)
+	data = content(50000)
+	(root / "file.bin").write_bytes(data)
+
+	location = str(tmp_path / "file.bin")
+	assert files._download_probe(base_url + "file.bin") == {"size": None, "ranges": False, "validator": None}
+	files.download_file(base_url + "file.bin", location)
+
+	with open(location, "rb") as f:
+		assert f.read() == data
+
+def test_empty_file(served, tmp_path):
+	root, httpd, base_url = served()
+	(root / "empty.bin").write_bytes(b"")
+
+	location = str(tmp_path / "empty.bin")
+	files.download_file(base_url + "empty.bin", location)
+
+	assert os.path.getsize(location) == 0
+	assert httpd.ranges == ["bytes=0-0", None]
+
+def test_resume(served, tmp_path, small_segments):
+	root, httpd, base_url = served()
+	data = content(8000)
+	(root / "file.bin").write_bytes(data)
+	url = base_url + "file.bin"
+	info = files._download_probe(url)
+
+	# An earlier run finished the first segment and half the second, the rest of the file is unwritten
+	partial = str(tmp_path / ".file.bin.part")
+	with open(partial, "wb") as f:
+		f.write(data[:6000])
+		f.truncate(8000)
+	files._download_save_state(partial + ".state", {
+		"url": url,
+		"size": 8000,
+		"validator": info["validator"],
+		"segments": [[0, 4000, 4000], [4000, 8000, 2000]],
+	})
+	httpd.ranges.clear()
+
+	location = str(tmp_path / "file.bin")
+	files.download_file(url, location)
+
+	with open(location, "rb") as f:
+		assert f.read() == data
+	assert httpd.ranges == ["bytes=0-0", "bytes=6000-7999"]
+	assert not os.path.exists(partial + ".state")
+
+def test_restart_when_file_changed(served, tmp_path, small_segments):
+	root, httpd, base_url = served()
+	data = content(8000)
+	(root / "file.bin").write_bytes(data)
+	url = base_url + "file.bin"
+
+	# State of a different version of the file is not resumed from
+	partial = str(tmp_path / ".file.bin.part")
+	with open(partial, "wb") as f:
+		f.write(b"x" * 8000)
+	files._download_save_state(partial + ".state", {
+		"url": url,
+		"size": 8000,
+		"validator": '"old"',
+		"segments": [[0, 4000, 4000], [4000, 8000, 4000]],
+	})
+
+	location = str(tmp_path / "file.bin")
+	files.download_file(url, location)
+
+	with open(location, "rb") as f:
+		assert f.read() == data
@@ -0,0 +1,57 @@
+# Cached pages against the local bench server, counting the requests they make
+
+import threading
+
+import pytest
+
+import server
+from central import files, net
+
+class CountingHandler(server.Handler):
+	"""Records whether each GET it serves was conditional."""
+
+	def do_GET(self) -> None:
+		with self.server.lock:
+			self.server.requests.append(self.headers.get("If-None-Match") is not None)
+		super().do_GET()
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+	root = tmp_path / "served"
+	root.mkdir()
+	(root / "page.html").write_text("<html><body>Page</body></html>")
+
+	monkeypatch.setattr(files, "CACHE_DIR", str(tmp_path / "cache") + "/")
+	files.cache_memory_clear()
+	# Local urls are not ones normalize_url accepts
+	monkeypatch.setattr(net, "normalize_url", lambda url: url)
+
+	httpd, base_url = server.start(str(root), CountingHandler)
+	httpd.requests = []
+	httpd.lock = threading.Lock()
+	yield root, httpd, base_url
+
+	httpd.shutdown()
+	httpd.server_close()
+	files.cache_memory_clear()
+
+def test_first_fetch_is_not_revalidated(site):
+	root, httpd, base_url = site
+	assert net.get_page_cached(base_url + "page.html", revalidate=True) == "<html><body>Page</body></html>"
+	assert httpd.requests == [False]
+
+def test_later_fetches_are_revalidated(site):
+	root, httpd, base_url = site
+	net.get_page_cached(base_url + "page.html", revalidate=True)
+	assert net.get_page_cached(base_url + "page.html", revalidate=True) == "<html><body>Page</body></html>"
+
+	(root / "page.html").write_text("<html><body>Changed</body></html>")
+	assert net.get_page_cached(base_url + "page.html", revalidate=True) == "<html><body>Changed</body></html>"
+	assert httpd.requests == [False, True, True]
+
+def test_without_revalidation(site):
+	root, httpd, base_url = site
+	net.get_page_cached(base_url + "page.html")
+	(root / "page.html").write_text("<html><body>Changed</body></html>")
+	assert net.get_page_cached(base_url + "page.html") == "<html><body>Page</body></html>"
+	assert httpd.requests == [False]
@@ -0,0 +1,58 @@
+# Resolving links found on story pages, with urls and through parse
+
+import pytest
+
+from central import files, net, parse, urls
+
+@pytest.mark.parametrize("url, link, expected", [
+	("https://www.example.com/story/", "chapter-2", "https://www.example.com/story/chapter-2"),
+	("https://www.example.com/story", "chapter-2", "https://www.example.com/chapter-2"),
+	("https://www.example.com/threads/story.1/", "page-3", "https://www.example.com/threads/story.1/page-3"),
+	("https://www.example.com/s/12/1", "2", "https://www.example.com/s/12/2"),
+	("https://www.example.com/s/12/1", "../13/1", "https://www.example.com/s/13/1"),
+	("https://www.example.com/a/b/", "/c/d", "https://www.example.com/c/d"),
+	("https://www.example.com/read?c=1", "?c=2", "https://www.example.com/read?c=2"),
+	("https://www.example.com/read/", "next?c=2#top", "https://www.example.com/read/next?c=2"),
+	("https://www.example.com/a", "https://www.other.com/b/", "https://www.other.com/b"),
+	("www.example.com/a/", "b", "https://www.example.com/a/b"),
+])
+def test_join(url, link, expected):
+	assert urls.join(url, link) == expected
+
+def test_resolve_keeps_trailing_slash():
+	assert urls.resolve("https://www.example.com/s/", "1/#end") == "https://www.example.com/s/1/"
+
+def test_invalid_links():
+	assert urls.join("https://www.example.com/", "http://[::1") is None
+	assert urls.normalize_links("https://www.example.com/", ["a", None]) == ["https://www.example.com/a", None]
+
+def page(links: str, head="") -> str:
+	return "<html><head><title>Story</title>" + head + "</head><body><p>Text.</p>" + links + "</body></html>"
+
+@pytest.fixture(params=[False, True], ids=["full", "partial"])
+def soup(request, monkeypatch):
+	monkeypatch.setattr(parse, "STORY_PARTIAL_PARSE", request.param)
+	return parse.story_soup
+
+@pytest.mark.parametrize("url, markup, expected", [
+	("https://www.example.com/story/", page('<a href="chapter-2">Next &gt;&gt;</a>'), "https://www.example.com/story/chapter-2"),
+	("https://www.example.com/s/12/1", page('<a href="2">Next »</a>'), "https://www.example.com/s/12/2"),
+	("https://www.example.com/s/12/1", page('<a href="/s/12/2">Next »</a>'), "https://www.example.com/s/12/2"),
+	("https://www.example.com/read?c=1", page('<a href="?c=2">&gt;&gt;</a>'), "https://www.example.com/read?c=2"),
+	("https://www.example.com/a/p1", page('<a href="p2">»</a>', '<base href="https://www.other.com/a/">'), "https://www.other.com/a/p2"),
+	("https://www.example.com/a/b/p1", page('<a href="p2">»</a>', '<base href="/c/">'), "https://www.example.com/c/p2"),
+	("https://www.example.com/s/1", page('<a href="#top">»</a><a href="1">»</a><a href="2">»</a>'), "https://www.example.com/s/2"),
+	("https://www.example.com/s/1", page('<a href="2">Next</a>'), None),
+])
+def test_next_story_link(soup, url, markup, expected):
+	assert parse.next_story_link(soup(markup), url) == expected
+
+def test_analyse_page_resolves_against_requested_url(tmp_path, monkeypatch):
+	monkeypatch.setattr(files, "CACHE_DIR", str(tmp_path) + "/")
+	files.cache_memory_clear()
+	monkeypatch.setattr(net, "get_page_cached", lambda url, revalidate=None: page('<a href="chapter-2">Next &gt;&gt;</a>'))
+
+	record = parse.analyse_page("https://www.example.com/story/")
+	assert record["url"] == "https://www.example.com/story"
+	assert record["next"] == "https://www.example.com/story/chapter-2"
+	files.cache_memory_clear()
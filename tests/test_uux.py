@@ -0,0 +1,20 @@
+# Pieces display_page() shows a text as
+
+from central import uux
+
+def test_sentences_keep_their_space():
+	pieces = uux.wrap_page_text("Hello there. General Kenobi.", 100)
+	assert pieces == ["Hello there. ", "General Kenobi. "]
+	assert "".join(pieces) == "Hello there. General Kenobi. "
+
+def test_texts_follow_on_with_a_space():
+	texts = ["General Kenobi.", '"You are a bold one".']
+	assert "".join(piece for text in texts for piece in uux.wrap_page_text(text, 100)) == 'General Kenobi. "You are a bold one". '
+
+def test_periods_within_words():
+	assert uux.wrap_page_text("Version 3.5 is out", 100) == ["Version 3.", "5 is out"]
+
+def test_wrapped_lines():
+	text = "One two three four five. Six seven eight nine ten. Eleven twelve."
+	pieces = uux.wrap_page_text(text, 30)
+	assert pieces == ["One two three four five. ", "Six", "\n", "  seven eight nine ten. ", "Eleven", "\n", "  twelve. "]